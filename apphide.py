@@ -25,27 +25,33 @@ which will tell "Gnome Shell" not to show that application.
 
 # Standard library imports
 from collections import defaultdict
+from contextlib import contextmanager, nullcontext
 from argparse import ArgumentParser
-from functools import lru_cache
+import concurrent.futures
+import itertools
+import bisect
 import logging
+import threading
+import atexit
+import time
+import socket
+import signal
 import hashlib
+import unicodedata
+import fnmatch
+import sqlite3
+import fcntl
 import shutil
+import re
 import json
 import sys
+import io
 import os
 
 # XDG Package imports
 import xdg.Exceptions
-import xdg.DesktopEntry
 import xdg.BaseDirectory
-
-# Import Gtk 3.0 Specifically
-import gi
-gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk
-from gi.repository import Gio
-from gi.repository import Pango
-from gi.repository import GdkPixbuf
+import xdg.Locale
 
 __repo__ = "https://github.com/willforde/AppHide.git"
 __copyright__ = "Copyright (C) 2016 William Forde"
@@ -56,6 +62,9 @@ __version__ = "1.0.1"
 # Constants
 DESKTOP = os.environ.get("XDG_CURRENT_DESKTOP")
 DEFAULT_ICON = "application-default-icon"
+# Seconds a client waits for the daemon to accept a request, and for the response once it was accepted
+DAEMON_ACCEPT_TIMEOUT = 2
+DAEMON_RESPONSE_TIMEOUT = 120
 
 # Logging
 logger = logging.getLogger("apphide")
@@ -64,249 +73,130 @@ consoleHandler.setLevel(logging.DEBUG)
 logger.addHandler(consoleHandler)
 
 
-class AppHideApp(Gtk.Application):
-    def __init__(self):
-        super().__init__(application_id="org.apphide.py", flags=Gio.ApplicationFlags.FLAGS_NONE)
-        self.window = None
-
-    def do_activate(self):
-        if not self.window:
-            self.window = AppHideWin(application=self, title="AppHide")
-            self.window.connect("delete-event", self.on_quit)
-            self.window.show_all()
-        self.window.present()
-
-    def on_quit(self, *_):
-        if self.window.row_changed:
-            self.info_dialog()
-        self.quit()
-
-    def info_dialog(self):
-        """Display a error dialog when unable to hide/unhide an application"""
-        dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.INFO, Gtk.ButtonsType.OK, "Action Required")
-        dialog.format_secondary_text("You may need to logout and login again for change to take effect")
-        dialog.run()
-        dialog.destroy()
-
-
-class AppHideWin(Gtk.ApplicationWindow):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.set_default_icon_name(DEFAULT_ICON)
-        self.set_default_size(860, 800)
-        self.filter_by = None
-
-        # The outer box to store the filter box and scrolledwindow
-        outer_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
-        outer_box.set_halign(Gtk.Align.CENTER)
-        self.add(outer_box)
-
-        # Filter box to store the filter radio button
-        filter_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
-        filter_box.set_halign(Gtk.Align.CENTER)
-        filter_box.set_valign(Gtk.Align.START)
-        outer_box.add(filter_box)
-
-        # All Radio Button
-        btn_filter_all = Gtk.RadioButton.new_with_label_from_widget(None, "All")
-        btn_filter_all.connect("toggled", self.on_radio_toggled, None)
-        btn_filter_all.set_tooltip_text("Show all applications")
-        filter_box.pack_start(btn_filter_all, False, False, 0)
-
-        # Hidden Radio Button
-        btn_filter_hidden = Gtk.RadioButton.new_with_label_from_widget(btn_filter_all, "Hidden")
-        btn_filter_hidden.connect("toggled", self.on_radio_toggled, "Hidden")
-        btn_filter_hidden.set_tooltip_text("Show only hidden applications")
-        filter_box.pack_start(btn_filter_hidden, False, False, 0)
-
-        # UnHidden Radio Button
-        btn_filter_unhidden = Gtk.RadioButton.new_with_label_from_widget(btn_filter_all, "Not Hidden")
-        btn_filter_unhidden.connect("toggled", self.on_radio_toggled, "UnHidden")
-        btn_filter_unhidden.set_tooltip_text("Show only unhidden applications")
-        filter_box.pack_start(btn_filter_unhidden, False, False, 0)
-
-        # Scrolledwindow to scroll through all applications
-        scrolledwindow = Gtk.ScrolledWindow()
-        scrolledwindow.set_hexpand(False)
-        scrolledwindow.set_vexpand(True)
-        scrolledwindow.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
-        self.scroll_adj = scrolledwindow.get_vadjustment()
-        outer_box.add(scrolledwindow)
-
-        # Iner box to store listbox
-        iner_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
-        iner_box.set_halign(Gtk.Align.CENTER)
-        iner_box.set_valign(Gtk.Align.START)
-        iner_box.set_size_request(860, -1)
-        iner_box.set_margin_right(16)
-        iner_box.set_margin_left(16)
-        scrolledwindow.add(iner_box)
-
-        # Listbox to list all applications
-        self.listbox = Gtk.ListBox()
-        self.listbox.connect("row-activated", self.on_row_activated)
-        self.listbox.set_selection_mode(Gtk.SelectionMode.NONE)
-        iner_box.pack_end(self.listbox, True, True, 0)
-
-        # Fetch list of all applications and sort by name
-        try:
-            xdg_apps = get_xdg_apps()
-        except OSError as e:
-            msg = "Failed to read aplication data. Sorry."
-            self.error_dialog(msg, e)
-            logger.exception(msg)
-            kwargs["application"].quit()
-        else:
-            # Add all found applications to the listbox
-            for xdg_app in xdg_apps:
-                row = ListBoxRowApp()
-                row.btn_hide.connect("clicked", self.on_hide_clicked, row, xdg_app)
-                row.set_icon(xdg_app.icon)
-                row.set_name(xdg_app.name)
-                row.set_description(xdg_app.description)
-                row.hidden = xdg_app.nodisplay
-                self.listbox.add(row)
-
-        # Install filter to filter resutls to all / Hidden / UnHidden
-        self.listbox.set_filter_func(self.filter_listbox, None, False)
-        self.listbox.set_header_func(self.header_func, None)
-        self.row_changed = False
-        self.listbox.show_all()
+def file_signature(filepath):
+    """Return the (mtime, size, inode) signature of given file, used to detect changes without reading it."""
+    stat = os.stat(filepath)
+    return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
 
-    @staticmethod
-    def header_func(row, before, _):
-        existing_header = row.get_header()
-        if existing_header:
-            if before:
-                existing_header.show()
-            else:
-                existing_header.hide()
-        elif before:
-            separator = Gtk.Separator(orientation=Gtk.Orientation.HORIZONTAL)
-            row.set_header(separator)
-
-    def on_radio_toggled(self, _, filter_by):
-        if not self.filter_by == filter_by:
-            self.filter_by = filter_by
-            self.scroll_adj.set_value(0.0)
-            self.listbox.invalidate_filter()
-            self.listbox.invalidate_headers()
 
-    def filter_listbox(self, row, *_):
-        if self.filter_by is None:
-            return True
-        elif self.filter_by == "Hidden":
-            return row.hidden
-        else:
-            return not row.hidden
-
-    def error_dialog(self, error_msg, error_obj):
-        """Display a error dialog when unable to hide/unhide an application"""
-        dialog = Gtk.MessageDialog(self, 0, Gtk.MessageType.ERROR, Gtk.ButtonsType.CANCEL, error_msg)
-        dialog.format_secondary_text(str(error_obj))
-        dialog.run()
-        dialog.destroy()
-
-    def on_hide_clicked(self, button, row, xdg_file):
-        # Set label of button to Hide/UnHide, depending on active state
-        active = button.get_active()
-        try:
-            xdg_file.nodisplay = active
-        except OSError as e:
-            button.set_active(not active)
-            self.error_dialog("Failed to %s %s" % ("Hide" if active else "Show", xdg_file.name), e)
-        else:
-            text = "Show" if active else "Hide"
-            button.set_label(text)
-            button.set_tooltip_text("%s application" % text)
-            self.row_changed = True
-            row.changed()
-
-    @staticmethod
-    def on_row_activated(_, row):
-        row.hidden = not row.hidden
-
-
-class ListBoxRowApp(Gtk.ListBoxRow):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        iner_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
-        iner_box.set_margin_top(16)
-        iner_box.set_margin_bottom(16)
-        self.add(iner_box)
-
-        # Icon
-        self._app_icon = Gtk.Image()
-        self._app_icon.set_pixel_size(64)
-        self._app_icon.set_valign(Gtk.Align.CENTER)
-        self._app_icon.set_halign(Gtk.Align.START)
-        iner_box.pack_start(self._app_icon, True, True, 16)
-
-        # Name
-        self._app_name = WrapedLabel()
-        self._app_name.set_size_request(165, -1)
-        self._app_name.set_max_width_chars(20)
-        iner_box.pack_start(self._app_name, True, True, 0)
-
-        # Description
-        self._app_description = WrapedLabel()
-        self._app_description.set_size_request(400, -1)
-        self._app_description.set_max_width_chars(50)
-        self._app_description.set_margin_left(16)
-        iner_box.pack_start(self._app_description, True, True, 16)
-
-        # Button
-        self.btn_hide = Gtk.ToggleButton("Hide")
-        self.btn_hide.set_size_request(100, -1)
-        self.btn_hide.set_halign(Gtk.Align.END)
-        self.btn_hide.set_valign(Gtk.Align.CENTER)
-        self.btn_hide.set_tooltip_text("Hide application")
-        iner_box.pack_start(self.btn_hide, True, True, 24)
-
-    def set_name(self, name):
-        """Set the name of application"""
-        self._app_name.set_label(name)
-
-    def set_icon(self, icon):
-        """Set the Icon of the application"""
-        if os.path.isfile(icon):
-            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(icon, width=64, height=64, preserve_aspect_ratio=False)
-            self._app_icon.set_from_pixbuf(pixbuf)
-        else:
-            self._app_icon.set_from_icon_name(icon, Gtk.IconSize.DIALOG)
+def within_dir(path, directory):
+    """Return True if path is the directory or within it, "/home/al" doesn't contain "/home/alice"."""
+    return path == directory or path.startswith(os.path.join(directory, ""))
 
-    def set_description(self, description):
-        """Set the description of the application"""
-        self._app_description.set_label(description)
 
-    @property
-    def hidden(self):
-        """Return True/False if the row is hidden or not"""
-        return self.btn_hide.get_active()
+@contextmanager
+def file_lock(lock_path):
+    """
+    Hold an exclusive advisory lock on the given lock file, while within the context.
+    The lock is taken with flock, which belongs to the open file, so it also excludes other threads.
+    """
+    with open(lock_path, "a") as stream:
+        with profiler.span("lock.wait"):
+            fcntl.flock(stream.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(stream.fileno(), fcntl.LOCK_UN)
 
-    @hidden.setter
-    def hidden(self, value):
-        """Set the state of the toggle button"""
-        self.btn_hide.set_active(value)
 
+@contextmanager
+def atomic_write(filepath, mode="w", fsync=False):
+    """
+    Write to a temporary file within the same directory, that replaces the given file when the context exits.
+    A partially written file never replaces the given file, and the temporary file is removed if writing fails.
+    The permissions of an existing file are kept, the same as writing to it in place would.
+    """
+    # Unique per process and thread, as the same file may be written by worker threads
+    tmp_path = "%s.%d.%d.tmp" % (filepath, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp_path, mode) as stream:
+            yield stream
+            if fsync:
+                stream.flush()
+                os.fsync(stream.fileno())
+
+        if os.path.exists(filepath):
+            shutil.copymode(filepath, tmp_path)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class Profiler(object):
+    """
+    Time spent within each phase and counters of the work done, for diagnosing slow setups.
+    Profiling is disabled by default, then spans are a shared no-op context and counters return right away.
+    """
+    _null_span = nullcontext()
 
-class WrapedLabel(Gtk.Label):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        # Set line count to 3 and enable line wrap
-        self.set_lines(3)
-        self.set_line_wrap(True)
+    def __init__(self):
+        self.enabled = False
+        self.output = None
+        self.spans = defaultdict(lambda: [0, 0.0])
+        self.counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def enable(self, output="-"):
+        """
+        Start profiling, the summary is reported when the program exits.
+
+        :param output: Path of the json file to write the summary to, "-" or "1" to print it to stderr.
+        """
+        if not self.enabled:
+            self.enabled = True
+            self.output = None if output in ("-", "1") else output
+            atexit.register(self.report)
+
+    def span(self, name):
+        """Return a context manager that adds the time spent within it to the given phase."""
+        return self._span(name) if self.enabled else self._null_span
+
+    @contextmanager
+    def _span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            # Spans can be entered from worker threads
+            with self._lock:
+                span = self.spans[name]
+                span[0] += 1
+                span[1] += elapsed
+
+    def count(self, name, amount=1):
+        """Add the amount to the given counter."""
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += amount
+
+    def summary(self):
+        """Return the collected spans and counters, times are in milliseconds."""
+        spans = {name: {"calls": calls, "total_ms": total * 1000} for name, (calls, total) in self.spans.items()}
+        return {"spans": spans, "counters": dict(self.counters)}
+
+    def report(self):
+        """Write the summary as json to the output file, or print it as a table to stderr."""
+        summary = self.summary()
+        if self.output:
+            with open(self.output, "w") as stream:
+                json.dump(summary, stream, indent=4)
+            return
 
-        # Set line wrap to work-char and ensure that it cuts out at the end of the third line
-        self.set_line_wrap_mode(Pango.WrapMode.WORD_CHAR)
-        self.set_ellipsize(Pango.EllipsizeMode.END)
+        lines = ["%-24s %8s %12s %10s" % ("phase", "calls", "total ms", "mean ms")]
+        for name, span in sorted(summary["spans"].items(), key=lambda item: item[1]["total_ms"], reverse=True):
+            lines.append("%-24s %8d %12.2f %10.3f" % (name, span["calls"], span["total_ms"],
+                                                      span["total_ms"] / span["calls"]))
+        lines.append("")
+        lines.append("%-24s %8s" % ("counter", "value"))
+        for name, value in sorted(summary["counters"].items()):
+            lines.append("%-24s %8d" % (name, value))
+        sys.stderr.write("\n".join(lines) + "\n")
 
-        # Align text to left side of widget
-        self.set_xalign(0.0)
 
-        # Align text box to top and to the left
-        self.set_valign(Gtk.Align.START)
-        self.set_halign(Gtk.Align.START)
+profiler = Profiler()
 
 
 class Tracker(object):
@@ -315,78 +205,255 @@ class Tracker(object):
     This allowed the program to detect if a xdg file was modified by the user outside of this program.
     Perventing this program from removing or replacing user modified xdg files.
     Instead xdg file will be modified inplace.
+
+    Tracked hashes are stored in a SQLite database, so each change is written
+    incrementally and a crash can never leave the tracker half written.
+
+    Many processes can use the tracker at once. Each process only writes the rows of the files it changed,
+    so changes are merged by the database instead of one process overwriting the tracker of another.
+    Changes of a xdg file are made while holding the lock of that file, see :meth:`lock`.
     """
-    _config_dir = xdg.BaseDirectory.save_config_path("apphide")
+    # Created when the tracker is loaded, pyxdg's save_config_path fails if another process creates it at once
+    _config_dir = os.path.join(xdg.BaseDirectory.xdg_config_home, "apphide")
+    _tracked_db = os.path.join(_config_dir, "tracker.db")
     _tracked_file = os.path.join(_config_dir, "tracker.json")
     _tracked_old_dir = os.path.join(_config_dir, "tracker")
+    _tracked_lock = os.path.join(_config_dir, "tracker.lock")
+    _locks_dir = os.path.join(_config_dir, "locks")
+
+    # Seconds to wait for another process that is writing to the database
+    _timeout = 30
+
+    # Stored as the user_version of the database, once it is created and the older tracker is migrated
+    _schema_version = 1
 
     def __init__(self):
+        with profiler.span("tracker.init"):
+            self._hashes = {}
+            self._batch_depth = 0
+            # Database writes are serialized, so files can be changed from worker threads
+            self._lock = threading.Lock()
+
+            # Create missing config directory
+            os.makedirs(self._config_dir, mode=0o700, exist_ok=True)
+
+            # Only one process may create the database and migrate the older tracker into it
+            with file_lock(self._tracked_lock):
+                # The tracker may be created by a background thread, but is only used by one thread at a time
+                self._db = sqlite3.connect(self._tracked_db, timeout=self._timeout, check_same_thread=False)
+                # The default rollback journal is kept, as the config directory may be on a network filesystem
+                # that is shared by many hosts, where a write ahead log can't be used.
+                # A tracker that was created with a write ahead log is switched back, once no one else has it open.
+                try:
+                    self._db.execute("PRAGMA journal_mode=DELETE")
+                except sqlite3.OperationalError as e:
+                    logger.debug("Unable to switch tracker to a rollback journal: %s", e)
+
+                if self._db.execute("PRAGMA user_version").fetchone()[0] < self._schema_version:
+                    self.create()
+
+            # Load in tracked file hashes, files that no longer exist are removed by collect_garbage()
+            self.load()
+
+    @classmethod
+    def set_config_dir(cls, config_dir):
+        """Store the tracker within the given config directory, used when processing the homes of other users"""
+        cls._config_dir = config_dir
+        cls._tracked_db = os.path.join(config_dir, "tracker.db")
+        cls._tracked_file = os.path.join(config_dir, "tracker.json")
+        cls._tracked_old_dir = os.path.join(config_dir, "tracker")
+        cls._tracked_lock = os.path.join(config_dir, "tracker.lock")
+        cls._locks_dir = os.path.join(config_dir, "locks")
+
+    def load(self):
+        """Load all tracked file hashes from the database"""
         self._hashes = {}
-        self._changed = False
+        for filepath, file_hash, mtime, size, inode in self._db.execute("SELECT * FROM tracked"):
+            signature = None if mtime is None else [mtime, size, inode]
+            self._hashes[filepath] = {"hash": file_hash, "stat": signature}
+
+    def refresh(self, filepath):
+        """Load the tracked hash of the given file again, as another process may have changed it"""
+        with self._lock:
+            row = self._db.execute("SELECT hash, mtime, size, inode FROM tracked WHERE path = ?",
+                                   (filepath,)).fetchone()
+        if row is None:
+            self._hashes.pop(filepath, None)
+        else:
+            signature = None if row[1] is None else list(row[1:])
+            self._hashes[filepath] = {"hash": row[0], "stat": signature}
 
-        # Load tracked data if config directory exists
-        if os.path.exists(self._config_dir):
-            # Load in tracked file hashes
-            if os.path.exists(self._tracked_file):
-                with open(self._tracked_file, "r") as stream:
-                    self._hashes = json.load(stream)
-                    self.cleanup()
+    @contextmanager
+    def lock(self, filepath):
+        """
+        Lock the given xdg file against changes by other processes and threads, while within the context.
+        The lock is taken on a separate lock file, as xdg files are replaced when they are written.
+        """
+        if not os.path.exists(self._locks_dir):
+            os.makedirs(self._locks_dir, exist_ok=True)
 
-            # Load & migrate tracked files from older version
-            elif os.path.exists(self._tracked_old_dir):
-                self.migrate()
-        else:
-            # Create missing config directory
-            os.makedirs(self._config_dir)
+        with file_lock(os.path.join(self._locks_dir, os.path.basename(filepath) + ".lock")):
+            yield
 
     def __contains__(self, filepath):
         """Return True/False if given file exists within tracker"""
         return filepath in self._hashes
 
     def add(self, filepath):
-        """Add the hash of the given file to be tracked"""
-        self._hashes[filepath] = self.hash_file(filepath)
-        self._changed = True
+        """Add the hash and stat signature of the given file to be tracked"""
+        self._hashes[filepath] = {"hash": self.hash_file(filepath), "stat": file_signature(filepath)}
+        self.store(filepath)
 
     def remove(self, filepath):
         """Remove given file's hash from the tracker"""
-        del self._hashes[filepath]
-        self._changed = True
+        with self._lock:
+            self._hashes.pop(filepath, None)
+            self._db.execute("DELETE FROM tracked WHERE path = ?", (filepath,))
+        profiler.count("tracker_writes")
+
+    def store(self, filepath):
+        """Write the tracked data of the given file to the database, committed on the next save."""
+        tracked = self._hashes[filepath]
+        signature = tracked["stat"] or [None, None, None]
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO tracked VALUES (?, ?, ?, ?, ?)",
+                             [filepath, tracked["hash"]] + signature)
+        profiler.count("tracker_writes")
 
     def compare(self, filepath):
-        """Compare hash of given file with the stored hash"""
+        """
+        Compare hash of given file with the stored hash.
+        The file is only hashed if its stat signature has changed since it was last tracked.
+        """
+        tracked = self._hashes[filepath]
+        signature = file_signature(filepath)
+        if tracked["stat"] == signature:
+            return True
+
         file_hash = self.hash_file(filepath)
-        if self._hashes[filepath] == file_hash:
+        if tracked["hash"] == file_hash:
+            # Content is unchanged so store the new signature to skip hashing next time
+            tracked["stat"] = signature
+            self.store(filepath)
             return True
         else:
             logger.debug("Store hash is not a match for file: %s", filepath)
-            logger.debug("%s != %s", self._hashes[filepath], file_hash)
+            logger.debug("%s != %s", tracked["hash"], file_hash)
             self.remove(filepath)
             return False
 
     def save(self):
-        if self._changed:
-            self._changed = False
-            with open(self._tracked_file, "w") as stream:
-                json.dump(self._hashes, stream)
+        """Commit all pending changes, unless a batch is active, then the batch commits on exit."""
+        if not self._batch_depth:
+            self.commit()
+
+    def commit(self):
+        """Commit all pending changes, even within a batch, used before the lock of a changed file is released."""
+        with profiler.span("tracker.save"), self._lock:
+            self._db.commit()
+
+    @contextmanager
+    def batch(self):
+        """
+        Group many changes into a single transaction. The changes are committed together
+        when the outer most batch exits, or rolled back if an exception is raised.
+        Only used for changes that don't lock a file, like garbage collection. Changes of xdg files are always
+        committed one at a time by :meth:`commit`, as they have to be committed while the file is locked.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        except Exception:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self._db.rollback()
+                self.load()
+            raise
+        else:
+            self._batch_depth -= 1
+            self.save()
+
+    def create(self):
+        """
+        Create the database and migrate the tracker of an older version into it. The migration is recorded
+        within the same transaction, so an interrupted migration is run again on the next start.
+        """
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.execute("CREATE TABLE IF NOT EXISTS tracked (path TEXT PRIMARY KEY, hash TEXT NOT NULL, "
+                             "mtime INTEGER, size INTEGER, inode INTEGER)")
+
+            # Load & migrate tracked files from older versions
+            if os.path.exists(self._tracked_file):
+                old_tracker = self._tracked_file if self.migrate_json() else None
+            elif os.path.exists(self._tracked_old_dir):
+                old_tracker = self.migrate()
+            else:
+                old_tracker = None
+
+            self._db.execute("PRAGMA user_version = %d" % self._schema_version)
+            self.commit()
+        except BaseException:
+            self._db.rollback()
+            raise
+
+        # Remove the old tracked data, once it's safely within the database
+        if old_tracker == self._tracked_file:
+            os.remove(self._tracked_file)
+        elif old_tracker:
+            shutil.rmtree(old_tracker)
 
     def migrate(self):
-        """Migrate from the older style of tracking to the new style"""
+        """Migrate from the older style of tracking to the new style, returns the old tracker directory"""
         for xdg_file in os.listdir(self._tracked_old_dir):
             if xdg_file.endswith(".desktop"):
                 xdg_path = os.path.join(xdg.BaseDirectory.save_data_path("applications"), xdg_file)
                 if os.path.exists(xdg_path):
                     self.add(xdg_path)
+        return self._tracked_old_dir
+
+    def migrate_json(self):
+        """
+        Migrate from the json tracker file of the older version.
+        Hash only entries get an empty stat signature, so the file will be hashed on the next compare.
+
+        A corrupt tracker file is moved aside, as the files it tracked can't be recovered from it.
+        Returns False if the tracker file was corrupt.
+        """
+        try:
+            with open(self._tracked_file, "r") as stream:
+                hashes = json.load(stream)
+            if not isinstance(hashes, dict):
+                raise ValueError("Expected a json object, got %s" % type(hashes).__name__)
+        except ValueError as e:
+            corrupt_file = self._tracked_file + ".corrupt"
+            logger.error("Tracker file is corrupt, moving it to %s: %s", corrupt_file, e)
+            os.replace(self._tracked_file, corrupt_file)
+            return False
 
-        # Remove all old tracked data & save
-        shutil.rmtree(self._tracked_old_dir)
-        self.save()
+        for filepath, tracked in hashes.items():
+            if isinstance(tracked, str):
+                tracked = {"hash": tracked, "stat": None}
+            self._hashes[filepath] = tracked
+            self.store(filepath)
 
-    def cleanup(self):
-        """Keep the tracker clean of files that don't exist anymore"""
-        for filepath in self._hashes.keys():
-            if not os.path.exists(filepath):
+        self.cleanup()
+        return True
+
+    def cleanup(self, dry_run=False):
+        """
+        Keep the tracker clean of files that don't exist anymore.
+        Returns the files that don't exist, they are only removed from the tracker if dry_run is False.
+        """
+        # Other processes may have tracked files since the tracker was loaded
+        self.load()
+
+        # Collect first, as removing changes the tracked hashes
+        missing = [filepath for filepath in self._hashes if not os.path.exists(filepath)]
+        if not dry_run:
+            for filepath in missing:
                 self.remove(filepath)
+        return missing
 
     @staticmethod
     def hash_file(filepath):
@@ -394,45 +461,703 @@ class Tracker(object):
         hasher = hashlib.sha224()
 
         # Read in file and update the hasher
-        with open(filepath, "rb") as stream:
-            hasher.update(stream.read())
+        with profiler.span("tracker.hash_file"), open(filepath, "rb") as stream:
+            data = stream.read()
+            hasher.update(data)
+        profiler.count("bytes_hashed", len(data))
 
         # Return a sha224 hash of the file
         return hasher.hexdigest()
 
 
-def get_xdg_apps():
+class ScanIndex(object):
+    """
+    Persistent index of the fields that are needed from each xdg file.
+    Directory listings, including subdirectories, are reused while the directory mtime is unchanged and
+    the parsed fields of a file are reused while its (mtime, size, inode) signature is unchanged.
+    So only new or changed xdg files have to be parsed again.
+
+    Directory mtimes are only as precise as the filesystem's timestamps, so a file added right after a listing
+    can leave the mtime unchanged. Like git's racy index check, a listing is only trusted once the directory mtime
+    is older than the listing by more than that precision.
+    """
+    _index_file = os.path.join(Tracker._config_dir, "index.json")
+    _version = 6
+
+    # Nanoseconds a directory mtime must be older than its listing, for the listing to be trusted
+    _racy_window = 1000000000
+
+    def __init__(self, rebuild=False):
+        self._dirs = {}
+        self._files = {}
+        self._checked = set()
+        self._changed = rebuild
+
+        # Load the index unless a full rebuild was requested
+        if not rebuild and os.path.exists(self._index_file):
+            try:
+                with open(self._index_file, "r") as stream:
+                    data = json.load(stream)
+            except ValueError:
+                logger.debug("Index file is corrupt, rebuilding index: %s", self._index_file)
+                self._changed = True
+            else:
+                # Localized fields are only valid for the locale they where resolved with
+                if data.get("version") == self._version and data.get("langs") == xdg.Locale.langs:
+                    self._dirs = data["dirs"]
+                    self._files = data["files"]
+                else:
+                    self._changed = True
+
+    def listdir(self, app_dir, prefix="", parents=frozenset()):
+        """
+        Return the desktop id and path of all ".desktop" files within the given applications directory.
+        Subdirectories are included, their files get the subdirectory as a prefix of the desktop id,
+        so "kde4/foo.desktop" has the id "kde4-foo.desktop".
+
+        Symlinked subdirectories are followed, the same as GLib does. Parents are the (device, inode) of
+        the directories above app_dir, a subdirectory that links back to one of them is skipped.
+        """
+        try:
+            stat = os.stat(app_dir)
+        except OSError:
+            # Forget about directories that no longer exist
+            if app_dir in self._dirs:
+                self.forget_dir(app_dir)
+            return []
+
+        dir_key = (stat.st_dev, stat.st_ino)
+        if dir_key in parents:
+            logger.debug("Skipping symlink loop: %s", app_dir)
+            return []
+        dir_mtime = stat.st_mtime_ns
+
+        cached = self._dirs.get(app_dir)
+        if cached and cached["mtime"] == dir_mtime and dir_mtime < cached["scanned"] - self._racy_window:
+            app_names = cached["files"]
+            sub_dirs = cached["dirs"]
+        else:
+            # The time is taken before listing, so files added while listing are within the racy window
+            scanned = time.time_ns()
+            app_names = []
+            sub_dirs = []
+            # The file type is taken from the directory listing, so only symlinks need an extra stat
+            with os.scandir(app_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".desktop"):
+                        if entry.is_file():
+                            app_names.append(entry.name)
+                    elif entry.is_dir():
+                        sub_dirs.append(entry.name)
+
+            if cached:
+                self.forget_dir(app_dir, keep=app_names + sub_dirs)
+            self._dirs[app_dir] = {"mtime": dir_mtime, "scanned": scanned, "files": app_names, "dirs": sub_dirs}
+            self._changed = True
+
+        dir_path = os.path.join(app_dir, "")
+        found = [(prefix + app_name, dir_path + app_name) for app_name in app_names]
+        parents = parents | {dir_key}
+        for sub_dir in sub_dirs:
+            found.extend(self.listdir(dir_path + sub_dir, prefix + sub_dir + "-", parents))
+        return found
+
+    def forget_dir(self, app_dir, keep=()):
+        """Remove the given directory and its files from the index, except for the files and subdirectories to keep."""
+        cached = self._dirs.pop(app_dir)
+        for app_name in cached["files"]:
+            if app_name not in keep:
+                self._files.pop(os.path.join(app_dir, app_name), None)
+
+        for sub_dir in cached["dirs"]:
+            sub_path = os.path.join(app_dir, sub_dir)
+            if sub_dir not in keep and sub_path in self._dirs:
+                self.forget_dir(sub_path)
+        self._changed = True
+
+    def load(self, filepath):
+        """Return the indexed data of given xdg file, parsing the file only if it has changed."""
+        cached = self._files.get(filepath)
+        if filepath in self._checked:
+            return DesktopRecord(filepath, cached["fields"])
+
+        signature = file_signature(filepath)
+        if cached and cached["stat"] == signature:
+            return DesktopRecord(filepath, cached["fields"])
+
+        fields = DesktopRecord.parse(filepath)
+        profiler.count("files_parsed")
+        self._files[filepath] = {"stat": signature, "fields": fields}
+        self._changed = True
+        return DesktopRecord(filepath, fields)
+
+    def preload(self, filepaths, workers=0, processes=False):
+        """
+        Parse all new or changed files, concurrently if workers are given, so waiting on file I/O overlaps.
+        Only the parsing runs in the workers, the index itself is only updated from the calling thread.
+        Workers only pay off for slow storage or very large trees, so files are parsed one at a time by default.
+
+        :param filepaths: List of xdg files that will be loaded.
+        :param workers: Max number of workers, 0 to parse the files one at a time.
+        :param processes: Use a process pool instead of a thread pool, for very large trees.
+                          The pool uses the executor's default number of workers if none are given.
+        """
+        stale = {}
+        for filepath in filepaths:
+            try:
+                signature = file_signature(filepath)
+            except OSError:
+                # Leave it to load() to report the error
+                continue
+
+            cached = self._files.get(filepath)
+            if not cached or cached["stat"] != signature:
+                stale[filepath] = signature
+            else:
+                self._checked.add(filepath)
+
+        if stale and not (workers or processes):
+            with profiler.span("index.preload"):
+                profiler.count("files_parsed", len(stale))
+                for filepath in stale:
+                    try:
+                        fields = DesktopRecord.parse(filepath)
+                    except OSError:
+                        # Removed by another process since it was listed, leave it to load() as well
+                        continue
+                    self._files[filepath] = {"stat": stale[filepath], "fields": fields}
+                    self._checked.add(filepath)
+            self._changed = True
+
+        elif stale:
+            # The process pool is only looked up when required, as it imports multiprocessing
+            if processes:
+                executor_class = concurrent.futures.ProcessPoolExecutor
+                parse = DesktopRecord.parse_in_process
+            else:
+                executor_class = concurrent.futures.ThreadPoolExecutor
+                parse = DesktopRecord.parse
+            with profiler.span("index.preload"), executor_class(max_workers=workers or None) as executor:
+                profiler.count("files_parsed", len(stale))
+                futures = {executor.submit(parse, filepath): filepath for filepath in stale}
+                for future in concurrent.futures.as_completed(futures):
+                    filepath = futures[future]
+                    try:
+                        fields = future.result()
+                    except OSError:
+                        # Removed by another process since it was listed, leave it to load() as well
+                        continue
+
+                    if processes:
+                        fields, error = fields
+                        if error:
+                            raise xdg.Exceptions.ParsingError(*error)
+                    self._files[filepath] = {"stat": stale[filepath], "fields": fields}
+                    self._checked.add(filepath)
+            self._changed = True
+
+    def save(self):
+        if self._changed:
+            self._changed = False
+            data = {"version": self._version, "langs": xdg.Locale.langs, "dirs": self._dirs, "files": self._files}
+            # Replace the index in one step, so other processes never load a partially written index
+            os.makedirs(os.path.dirname(self._index_file), mode=0o700, exist_ok=True)
+            with atomic_write(self._index_file) as stream:
+                json.dump(data, stream)
+
+
+class DesktopRecord(object):
+    """
+    Read only stand-in for a parsed xdg file, built from the fields stored in the index.
+    Provides the same getters as :class:`xdg.DesktopEntry.DesktopEntry` for the fields that are used.
+    """
+
+    def __init__(self, filename, fields):
+        self.filename = filename
+        self.fields = fields
+
+    _groups = ("Desktop Entry", "KDE Desktop Entry")
+    _localized = ("Name", "Comment", "Icon", "Keywords")
+    _lists = ("OnlyShowIn", "NotShowIn", "Keywords", "Categories")
+    _keys = ("Type", "NoDisplay", "Exec") + _localized + _lists
+    # Patterns start with a newline instead of ^, so the regex engine can skip from line to line
+    _header = re.compile(r"\n[ \t]*\[([^\n]*)")
+    _content_line = re.compile(r"\n[ \t]*[^#\s]")
+    _key_pattern = None
+
+    @classmethod
+    def parse(cls, filepath):
+        """Parse only the fields that are needed from the given xdg file"""
+        try:
+            return cls.read_fields(filepath)
+        except xdg.Exceptions.ParsingError as e:
+            logger.error("Failed to Parse XDG file: %s", e.file)
+            logger.error(e.msg)
+            raise
+
+    @classmethod
+    def parse_in_process(cls, filepath):
+        """
+        Parse the given xdg file within a worker process, returning the fields and the error.
+        ParsingError can't be unpickled, so the message and file of the error are returned instead.
+        """
+        try:
+            return cls.parse(filepath), None
+        except xdg.Exceptions.ParsingError as e:
+            # The message of the error already includes the file, which is added again when it's raised
+            prefix = "ParsingError in file '%s', " % e.file
+            return None, (e.msg[len(prefix):] if e.msg.startswith(prefix) else e.msg, e.file)
+
+    @classmethod
+    def read_fields(cls, filepath):
+        """
+        Read the main group of the given xdg file, resolving the fields the same way as pyxdg.
+        Only the lines of the main group are parsed, other groups like [Desktop Action] are skipped.
+
+        Unlike pyxdg, lines without a "=" are ignored instead of failing the whole file,
+        which saves checking every line of every file.
+        """
+        # Decoding all at once is cheaper than reading through a text stream
+        with open(filepath, "rb") as stream:
+            text = "\n" + stream.read().decode("utf-8", "replace")
+
+        # pyxdg reads with universal newlines, so a lone carriage return also ends a line
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+
+        # Only lines that are comments may come before the first group
+        headers = cls._header.finditer(text)
+        header = next(headers, None)
+        if cls._content_line.search(text, 0, header.start() if header else len(text)):
+            raise xdg.Exceptions.ParsingError("Parsing error on key, group missing", filepath)
+
+        # Find the body of the main groups, like pyxdg a repeated group replaces the earlier one
+        groups = {}
+        while header:
+            group = header.group(1).strip().lstrip("[").rstrip("]")
+            next_header = next(headers, None)
+            if group in cls._groups:
+                groups[group] = text[header.end():next_header.start() if next_header else len(text)]
+            header = next_header
+
+        # The KDE group is only used as a fallback
+        for group in cls._groups:
+            if group in groups:
+                body = groups[group]
+                break
+        else:
+            raise xdg.Exceptions.ParsingError("[%s]-Header missing" % cls._groups[0], filepath)
+
+        # Only the needed keys are kept, translations are only matched for the languages of the locale
+        content = {}
+        translated = set()
+        for key, lang, value in cls.key_pattern().findall(body):
+            if lang:
+                translated.add(key)
+                content["%s[%s]" % (key, lang)] = value.strip()
+            else:
+                content[key] = value.strip()
+
+        fields = {"Type": content.get("Type", ""),
+                  "NoDisplay": content.get("NoDisplay") in ("true", "True"),
+                  "Exec": content.get("Exec", "")}
+
+        # Localized keys fall back to the unlocalized key, like pyxdg they
+        # are only looked up when the unlocalized key exists
+        for key in cls._localized:
+            fields[key] = content.get(key, "")
+            if key in content and key in translated:
+                for lang in xdg.Locale.langs:
+                    langkey = "%s[%s]" % (key, lang)
+                    if langkey in content:
+                        fields[key] = content[langkey]
+                        break
+
+        # List values are split after the locale is resolved
+        for key in cls._lists:
+            fields[key] = cls.split_list(fields.get(key, content.get(key, "")))
+        return fields
+
+    @classmethod
+    def key_pattern(cls):
+        """Return the compiled pattern of the needed keys, for the languages of the current locale"""
+        if cls._key_pattern is None or cls._key_pattern[0] != xdg.Locale.langs:
+            keys = "|".join(dict.fromkeys(cls._keys))
+            langs = "|".join(re.escape(lang) for lang in xdg.Locale.langs) or "(?!)"
+            pattern = re.compile(r"\n[ \t]*(%s)(?:\[(%s)\])?[ \t]*=([^\n]*)" % (keys, langs))
+            cls._key_pattern = (list(xdg.Locale.langs), pattern)
+        return cls._key_pattern[1]
+
+    @staticmethod
+    def split_list(value):
+        """Split a list value on the first separator that is found, ignoring escaped separators."""
+        # Escaped separators are rare, so plain values are split without regular expressions
+        if "\\" not in value:
+            separators = [separator for separator in (";", "|", ",") if separator in value]
+            values = value.split(separators[0]) if separators else [value]
+        else:
+            for separator in (r"(?<!\\);", r"(?<!\\)\|", r"(?<!\\),"):
+                if re.search(separator, value):
+                    values = re.split(separator, value)
+                    break
+            else:
+                values = [value]
+
+        if values[-1] == "":
+            values.pop()
+        return values
+
+    def getName(self):
+        return self.fields["Name"]
+
+    def getComment(self):
+        return self.fields["Comment"]
+
+    def getIcon(self):
+        return self.fields["Icon"]
+
+    def getNoDisplay(self):
+        return self.fields["NoDisplay"]
+
+    def getType(self):
+        return self.fields["Type"]
+
+    def getOnlyShowIn(self):
+        return self.fields["OnlyShowIn"]
+
+    def getNotShowIn(self):
+        return self.fields["NotShowIn"]
+
+    def getKeywords(self):
+        return self.fields["Keywords"]
+
+    def getCategories(self):
+        return self.fields["Categories"]
+
+    def getExec(self):
+        return self.fields["Exec"]
+
+
+def write_nodisplay(src, dst, state, fsync=False):
+    """
+    Copy the source xdg file to dst, with only the NoDisplay key of the main group set to the given state.
+    All other bytes are copied as is, so comments, ordering and other groups are kept.
+
+    The copy is written to a temporary file next to dst, then moved over dst,
+    so dst is never left half written if the write fails or the system crashes.
+    A symlinked dst is written through to its target and the permissions of an existing dst are kept.
+
+    :param fsync: Flush the file and its directory to disk before returning.
+    """
+    with open(src, "rb") as stream:
+        lines = stream.read().splitlines(keepends=True)
+
+    # Find the main group, the KDE group is only used as a fallback, the same as when parsing
+    headers = {}
+    for number, line in enumerate(lines):
+        line = line.strip()
+        if line.startswith(b"["):
+            headers.setdefault(line, number)
+
+    for group in DesktopRecord._groups:
+        start = headers.get(("[%s]" % group).encode("utf-8"))
+        if start is not None:
+            break
+    else:
+        raise xdg.Exceptions.ParsingError("[%s]-Header missing" % DesktopRecord._groups[0], src)
+
+    # Replace the NoDisplay key of the main group, or add it after the last key of the group
+    value = b"NoDisplay=true" if state else b"NoDisplay=false"
+    insert_at = start + 1
+    patched = False
+    for number in range(start + 1, len(lines)):
+        line = lines[number].strip()
+        if line.startswith(b"["):
+            break
+        elif not line or line.startswith(b"#"):
+            continue
+
+        insert_at = number + 1
+        if line.split(b"=", 1)[0].strip() == b"NoDisplay":
+            lines[number] = value + lines[number][len(lines[number].rstrip(b"\r\n")):]
+            patched = True
+
+    if not patched:
+        if not lines[insert_at - 1].endswith(b"\n"):
+            lines[insert_at - 1] += b"\n"
+        lines.insert(insert_at, value + b"\n")
+
+    # Write through symlinks, so a linked user file, like one kept within a dotfiles repo, stays a link
+    dst = os.path.realpath(dst)
+    dst_dir = os.path.dirname(dst)
+    os.makedirs(dst_dir, exist_ok=True)
+
+    # A partially written file never replaces dst, and an existing file keeps its permissions
+    with atomic_write(dst, "wb", fsync) as stream:
+        stream.writelines(lines)
+
+    if fsync:
+        dir_fd = os.open(dst_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def normalize_text(text):
+    """Return the given text casefolded and without accents, so search queries match regardless of either."""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def get_xdg_apps(rebuild_index=False, workers=0, processes=False, appids=None, index=None):
     """
     Scan the Application directory for valid desktop entries.
     Returns a list of all xdg apps found. 
+
+    :param rebuild_index: Ignore the stored scan index and parse all xdg files again.
+    :param workers: Number of workers used to parse changed files, 0 to parse them one at a time.
+                    Parsing one at a time is faster on local disks, so workers are only used when asked for.
+    :param processes: Parse changed files using a process pool, of the given number of workers or
+                      the default number of workers if none are given.
+    :param appids: Only load the applications with the given lowercase appids, no other files are parsed.
+    :param index: Already loaded scan index to use, used by the fleet workers.
     """
+    if index is None:
+        index = ScanIndex(rebuild=rebuild_index)
     xdg_files = defaultdict(list)
-    for data_dir in xdg.BaseDirectory.xdg_data_dirs:
-        # Skip if applications directory does not exist
-        app_dir = os.path.join(data_dir, "applications")
-        if not os.path.exists(app_dir):
-            continue
+    with profiler.span("scan.listdir"):
+        for data_dir in xdg.BaseDirectory.xdg_data_dirs:
+            # Find all .desktop files within applications folder, files are grouped by desktop id
+            # and the data dirs are in order of precedence, so the first file of each id is used
+            app_dir = os.path.join(data_dir, "applications")
+            found = index.listdir(app_dir)
+            profiler.count("files_seen", len(found))
+            for desktop_id, app_path in found:
+                if appids is None or desktop_id.rsplit(".", 1)[0].lower() in appids:
+                    xdg_files[desktop_id].append(app_path)
+
+    # Parse the new or changed top level .desktop files, concurrently if workers are given
+    index.preload([app_files[0] for app_files in xdg_files.values()], workers, processes)
+
+    # Load all found .desktop files, leftovers of uninstalled apps are left for collect_garbage()
+    filtered_apps = []
+    with profiler.span("scan.load"):
+        for desktop_id, app_files in xdg_files.items():
+            # Another process may remove a user file while scanning, then the next file of the app is used
+            while app_files:
+                try:
+                    xdg_data = XDGManager(app_files, index, desktop_id)
+                except FileNotFoundError:
+                    app_files = app_files[1:]
+                else:
+                    if xdg_data and not xdg_data.leftover:
+                        filtered_apps.append(xdg_data)
+                    break
 
-        # Find all .desktop files within applications folder
-        for app_name in os.listdir(app_dir):
-            if app_name.endswith(".desktop"):
-                app_path = os.path.join(app_dir, app_name)
-                xdg_files[app_name].append(app_path)
+    with profiler.span("index.save"):
+        index.save()
+    return AppList(sorted(filtered_apps, key=lambda data: data.sort_key))
 
-    # Load all found .desktop files
-    filtered_apps = []
-    for app_files in xdg_files.values():
-        xdg_data = XDGManager(app_files)
-        if xdg_data:
-            filtered_apps.append(xdg_data)
-    return sorted(filtered_apps, key=lambda data: data.name.lower())
+
+def collect_garbage(dry_run=False):
+    """
+    Remove the leftover user files of uninstalled apps and forget tracked files that no longer exist.
+    Everything is removed in one sweep and the tracker is saved once, this is kept out of startup.
+    Returns the leftover files and the tracked files that no longer exist.
+
+    :param dry_run: Only report what would be removed.
+    """
+    tracker = XDGManager.get_tracker()
+    index = ScanIndex()
+    user_files = {}
+    system_ids = set()
+    with profiler.span("gc.scan"):
+        for data_dir in xdg.BaseDirectory.xdg_data_dirs:
+            user_dir = within_dir(data_dir, xdg.BaseDirectory.xdg_data_home)
+            for desktop_id, app_path in index.listdir(os.path.join(data_dir, "applications")):
+                if user_dir:
+                    user_files[app_path] = desktop_id
+                else:
+                    system_ids.add(desktop_id)
+        index.save()
+
+        # A tracked user file, without a system file to fall back to, belongs to an uninstalled app
+        leftovers = [filepath for filepath, desktop_id in user_files.items()
+                     if desktop_id not in system_ids and filepath in tracker]
+
+    if dry_run:
+        return leftovers, tracker.cleanup(dry_run=True)
+
+    with profiler.span("gc.sweep"), tracker.batch():
+        for filepath in leftovers:
+            logger.debug("Removing leftover file of uninstalled app: %s", filepath)
+            tracker.remove(filepath)
+            try:
+                os.remove(filepath)
+            except OSError:
+                logger.debug("Failed to remove leftover file.")
+        missing = tracker.cleanup()
+    return leftovers, missing
+
+
+class AppList(list):
+    """List of applications sorted by name, with an inverted index that is built on the first query."""
+    _index = None
+
+    @property
+    def index(self):
+        """Inverted index of the applications"""
+        if self._index is None:
+            with profiler.span("query.index"):
+                self._index = AppIndex(self)
+        return self._index
+
+    def query(self, **predicates):
+        """Return the applications that match all of the given predicates, in list order. See :meth:`AppIndex.query`"""
+        index = self.index
+        selected = index.query(**predicates)
+        return [index.apps[appid] for appid in sorted(selected, key=index.positions.__getitem__)]
+
+
+class AppIndex(object):
+    """
+    Inverted index that maps the categories, keywords, origin, executable, appid and name
+    of the applications to the appids that have them. Queries are evaluated against the
+    distinct values of each predicate and combined as sets, instead of checking every application.
+
+    Glob patterns are looked up within the sorted values, only the values that start with the
+    literal prefix of a pattern are matched against it. Regular expressions are matched against all values.
+    """
+    origins = ("user", "system", "flatpak")
+
+    # Words of an Exec command, quoted arguments are a single word
+    _exec_word = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+
+    def __init__(self, xdg_apps):
+        self.apps = {}
+        self.positions = {}
+        self.categories = defaultdict(set)
+        self.keywords = defaultdict(set)
+        self.origin = defaultdict(set)
+        self.exec_words = defaultdict(set)
+        self.names = defaultdict(set)
+
+        for position, xdg_app in enumerate(xdg_apps):
+            appid = xdg_app.appid
+            self.apps[appid] = xdg_app
+            self.positions[appid] = position
+            self.origin[xdg_app.origin].add(appid)
+            self.names[xdg_app.sort_key].add(appid)
+            for category in xdg_app.categories:
+                self.categories[category.lower()].add(appid)
+            for keyword in xdg_app.keywords:
+                self.keywords[keyword.lower()].add(appid)
+            for word in self.split_exec(xdg_app.exec):
+                self.exec_words[word].add(appid)
+
+        self.sorted_ids = sorted(self.apps)
+        self.sorted_names = sorted(self.names)
+        self.sorted_exec_words = sorted(self.exec_words)
+
+    @classmethod
+    def split_exec(cls, command):
+        """Return the lowercase words of the Exec command, paths are also included by their file name."""
+        words = set()
+        for quoted, word in cls._exec_word.findall(command.lower()):
+            word = quoted or word
+            words.add(word)
+            if "/" in word:
+                words.add(word.rsplit("/", 1)[1])
+        return words
+
+    def query(self, ids=(), names=(), categories=(), keywords=(), execs=(), origins=(), regex=False):
+        """
+        Return the set of appids that match all given predicates, the values of a predicate are alternatives.
+        All matching is case insensitive.
+
+        :param ids: Glob patterns to match the appid against.
+        :param names: Glob patterns to match the name against.
+        :param categories: Categories the application must be in.
+        :param keywords: Keywords the application must have.
+        :param execs: Glob patterns to match the words of the Exec command against, a path also matches by its
+                      file name. So "wine" matches "/usr/bin/wine app.exe", while "wine*" also matches "wine64".
+        :param origins: Where the loaded xdg file comes from, one of user, system or flatpak.
+        :param regex: Match the appid and name with regular expressions instead of glob patterns.
+        """
+        selected = set(self.apps)
+        if ids:
+            selected &= set(self.matching(self.sorted_ids, ids, regex))
+        if names:
+            selected &= self.union(self.names[name] for name in self.matching(self.sorted_names, names, regex))
+        if categories:
+            selected &= self.lookup(self.categories, categories)
+        if keywords:
+            selected &= self.lookup(self.keywords, keywords)
+        if origins:
+            selected &= self.lookup(self.origin, origins)
+        if execs:
+            words = self.matching(self.sorted_exec_words, execs, False)
+            selected &= self.union(self.exec_words[word] for word in words)
+        return selected
+
+    @staticmethod
+    def matching(keys, patterns, regex):
+        """Return the lowercase keys, out of the sorted keys, that match any of the patterns."""
+        if regex:
+            matchers = [re.compile(pattern, re.IGNORECASE).search for pattern in patterns]
+            return [key for key in keys if any(match(key) for match in matchers)]
+
+        found = []
+        for pattern in patterns:
+            pattern = pattern.lower()
+            prefix = re.split(r"[*?[]", pattern, 1)[0]
+            position = bisect.bisect_left(keys, prefix)
+
+            # Patterns without wildcards are a single lookup
+            if prefix == pattern:
+                if position < len(keys) and keys[position] == pattern:
+                    found.append(pattern)
+                continue
+
+            match = re.compile(fnmatch.translate(pattern)).match
+            while position < len(keys) and keys[position].startswith(prefix):
+                if match(keys[position]):
+                    found.append(keys[position])
+                position += 1
+        return found
+
+    def lookup(self, mapping, values):
+        """Return the appids of the given values within mapping."""
+        return self.union(mapping.get(value.lower(), ()) for value in values)
+
+    @staticmethod
+    def union(sets):
+        selected = set()
+        for appids in sets:
+            selected |= appids
+        return selected
 
 
 class XDGManager(object):
-    """Manager to handle loading and changing of xdg files."""
+    """
+    Manager to handle loading and changing of xdg files.
+    The used fields are resolved once when the xdg file is loaded, only the file paths are kept
+    to parse the xdg file again when it's changed. Slots keep the per application memory small.
+    """
+    __slots__ = ("xdg_files", "user_files", "system_files", "filepath", "filename", "appid", "name", "description",
+                 "icon", "exec", "keywords", "categories", "sort_key", "listed", "_nodisplay", "_search_text")
     _tracker = None
 
-    def __init__(self, app_files):
+    # Flush changed xdg files to disk before the change is tracked
+    fsync = False
+
+    def __init__(self, app_files, index=None, desktop_id=None):
+        """
+        :param app_files: All xdg files of the application, in order of precedence.
+        :param index: Scan index to load the top level xdg file from.
+        :param desktop_id: Desktop id of the application, defaults to the filename of the top level xdg file.
+        """
         self.xdg_files = app_files
         self.user_files = []
         self.system_files = []
@@ -444,124 +1169,146 @@ class XDGManager(object):
             else:
                 self.system_files.append(xdg_file)
 
-        # Load the top level xdg file
-        self.xdg_data = self.parse(self.xdg_files[0])
-        self.filename = os.path.basename(self.xdg_files[0])
+        # Load the top level xdg file, from the scan index if available
+        self.load(index.load(self.xdg_files[0]) if index else self.parse(self.xdg_files[0]))
+        self.filename = desktop_id or os.path.basename(self.xdg_files[0])
         self.filepath = self.xdg_files[0]
         self.appid = self.filename.rsplit(".", 1)[0].lower()
-        self.cleanup()
+
+    def load(self, xdg_data):
+        """Resolve the used fields of the given parsed xdg file, the parsed file itself is not kept"""
+        self.name = xdg_data.getName()
+        self.description = xdg_data.getComment()
+        self.icon = xdg_data.getIcon()
+        self.exec = xdg_data.getExec()
+        self.keywords = tuple(xdg_data.getKeywords())
+        self.categories = tuple(xdg_data.getCategories())
+        self.sort_key = self.name.lower()
+        self._nodisplay = xdg_data.getNoDisplay()
+        self._search_text = None
+
+        # The type and desktop restrictions can't be changed by this program, so they are only checked once
+        only_show_in = xdg_data.getOnlyShowIn()
+        self.listed = (xdg_data.getType() == "Application" and DESKTOP not in xdg_data.getNotShowIn() and
+                       (not only_show_in or DESKTOP in only_show_in))
 
     @property
     def tracker(self):
         """File tracker"""
+        return self.get_tracker()
+
+    @classmethod
+    def get_tracker(cls):
+        """Return the file tracker that is shared by all applications"""
         if XDGManager._tracker is None:
             XDGManager._tracker = Tracker()
         return XDGManager._tracker
 
-    def cleanup(self):
-        """Cleanup any leftover xdg file if app has been uninstalled."""
-        if self.user_files and not self.system_files and self.user_files[0] in self.tracker:
-            logger.debug("Detected uninstalled app: %s, removing leftover file: %s", self.name, self.user_files[0])
-            self.tracker.remove(self.user_files[0])
-            self.xdg_data = None
-
-            try:
-                os.remove(self.user_files[0])
-            except OSError:
-                logger.debug("Failed to remove leftover file.")
-
-            self.tracker.save()
+    @property
+    def leftover(self):
+        """
+        True if this is the leftover user file of an uninstalled app.
+        Only apps without a system file need the tracker, so it's not loaded otherwise.
+        """
+        return bool(self.user_files and not self.system_files and self.user_files[0] in self.tracker)
 
     def __bool__(self):
         """Return True if this is an Application and that it's allowed to be show on current desktop"""
-        if self.xdg_data and self.xdg_data.getType() == "Application":
-            # Hide app if we have not user file and if nodisplay is set to True by default
-            if not self.user_files and self.nodisplay:
-                return False
-
-            # Check that current desktop is not one of the restricted desktops
-            elif DESKTOP in self.xdg_data.getNotShowIn():
-                return False
-
-            # Check if this app is allowd to be shown on current desktop
-            elif self.xdg_data.getOnlyShowIn() and DESKTOP not in self.xdg_data.getOnlyShowIn():
-                return False
-
-            # Default to allow application
-            else:
-                return True
-        else:
-            return False
-
-    @property
-    def name(self):
-        """Name of application"""
-        return self.xdg_data.getName()
+        # Hide app if we have not user file and if nodisplay is set to True by default
+        return self.listed and bool(self.user_files or not self.nodisplay)
 
     @property
-    def icon(self):
-        """Icon image associated with application"""
-        return self.xdg_data.getIcon()
+    def origin(self):
+        """Where the loaded xdg file comes from, either user, system or flatpak"""
+        if "flatpak/exports" in self.filepath:
+            return "flatpak"
+        return "user" if self.filepath in self.user_files else "system"
 
     @property
-    def description(self):
-        """Description of application"""
-        return self.xdg_data.getComment()
+    def search_text(self):
+        """
+        Normalized text of the name, comment, keywords, appid and executable, to match search queries against.
+        Built on first use, so the getters are not called again for every query.
+        """
+        if self._search_text is None:
+            fields = [self.name, self.description, self.appid, self.exec]
+            fields.extend(self.keywords)
+            self._search_text = normalize_text("\n".join(fields))
+        return self._search_text
 
     @property
     def nodisplay(self):
         """State of the nodisplay option"""
-        return self.xdg_data.getNoDisplay()
+        return self._nodisplay
 
     @nodisplay.setter
     def nodisplay(self, state):
         """Hide or show an application by changing the state of NoDisplay."""
-        # Ignore change if nodisplay is already the required state
-        # Can happen when called via command line
-        if self.nodisplay == state:
-            return
+        self.set_nodisplay(state)
+
+    def set_nodisplay(self, state):
+        """
+        Hide or show an application by changing the state of NoDisplay.
+        Returns False if the application already had the required state.
 
-        log_state = "Hiding application: %s" if state else "Showing application: %s"
-        logger.info(log_state, self.name)
-        src_xdg_data = self.source_data()
+        The change is made while the user xdg file is locked, and the current state is checked again
+        within the lock, as another process may have changed the application since it was loaded.
+        """
         dst = self.save_path()
+        with self.tracker.lock(dst):
+            self.tracker.refresh(dst)
+            src_xdg_data = self.source_data()
+
+            # If src_xdg_data is not the same as xdg_data then we must have loaded it from system
+            from_source = src_xdg_data.filename != dst
+
+            # Ignore change if nodisplay is already the required state
+            # Can happen when called via command line
+            xdg_data = self.parse(dst) if from_source and os.path.exists(dst) else src_xdg_data
+            if xdg_data.getNoDisplay() == state:
+                self.load(xdg_data)
+                return False
 
-        # If src_xdg_data is not the same as xdg_data then we must have loaded it from system
-        from_source = src_xdg_data.filename is not dst
+            log_state = "Hiding application: %s" if state else "Showing application: %s"
+            logger.info(log_state, self.name)
 
-        # Remove user xdg file and revert back to source xdg file if source file has required state
-        # and it was loaded from system. Keeps the system clean of unnecessary files.
-        if from_source and src_xdg_data.getNoDisplay() == state:
-            logger.debug("Switching to using source xdg file. Removing user xdg file: %s", dst)
-            self.tracker.remove(dst)
-            os.remove(dst)
-        else:
-            src_xdg_data.set("NoDisplay", str(state).lower(), "Desktop Entry")
-            src_xdg_data.write(dst)
+            # Remove user xdg file and revert back to source xdg file if source file has required state
+            # and it was loaded from system. Keeps the system clean of unnecessary files.
+            if from_source and src_xdg_data.getNoDisplay() == state:
+                logger.debug("Switching to using source xdg file. Removing user xdg file: %s", dst)
+                self.tracker.remove(dst)
+                os.remove(dst)
+            else:
+                write_nodisplay(src_xdg_data.filename, dst, state, self.fsync)
+                src_xdg_data = DesktopRecord(dst, dict(src_xdg_data.fields, NoDisplay=state))
 
-            # Track the new xdg file, so that the file can be checked if it was modified
-            # We don't want to override the user file from source, if the user modified it
-            if from_source:
-                self.tracker.add(dst)
+                # Track the new xdg file, so that the file can be checked if it was modified
+                # We don't want to override the user file from source, if the user modified it
+                if from_source:
+                    self.tracker.add(dst)
 
-        self.tracker.save()
-        self.xdg_data = src_xdg_data
+            # The change must be visible to other processes before the file is unlocked
+            self.tracker.commit()
+        self.load(src_xdg_data)
+        return True
 
     def source_data(self):
-        """Return path to the source ".desktop" file, of this application."""
-        if len(self.xdg_files) == 1:
-            return self.xdg_data
-
-        if not self.system_files or not self.user_files:
-            return self.xdg_data
-        else:
-            save_path = self.save_path()
-            if os.path.exists(save_path) and save_path in self.tracker and self.tracker.compare(save_path):
+        """
+        Return the parsed source ".desktop" file, of this application.
+        The file is always parsed again here, as the loaded fields may be out of date.
+        The user file is checked on disk, as it may have been created or removed since it was loaded.
+        """
+        save_path = self.save_path()
+        if os.path.exists(save_path):
+            if self.system_files and save_path in self.tracker and self.tracker.compare(save_path):
                 return self.parse(self.system_files[0])
             else:
-                return self.xdg_data
+                return self.parse(save_path)
+        elif self.system_files:
+            return self.parse(self.system_files[0])
+        else:
+            return self.parse(self.filepath)
 
-    @lru_cache(maxsize=None)
     def save_path(self):
         """Return path to the user's ".desktop" file, of this applicaion."""
         if self.filepath.startswith(xdg.BaseDirectory.xdg_data_home):
@@ -579,25 +1326,407 @@ class XDGManager(object):
     @staticmethod
     def parse(filepath):
         """Parse the given xdg file"""
-        try:
-            return xdg.DesktopEntry.DesktopEntry(filepath)
-        except xdg.Exceptions.ParsingError as e:
-            logger.error("Failed to Parse XDG file: %s", e.file)
-            logger.error(e.msg)
-            raise
+        profiler.count("files_parsed")
+        with profiler.span("xdg.parse"):
+            return DesktopRecord(filepath, DesktopRecord.parse(filepath))
 
     def __repr__(self):
         return "XDGManager({})".format(repr(self.xdg_files))
 
 
-class CLIManager(object):
+class AppWatcher(object):
+    """
+    Monitor all applications directories and report which applications have changed.
+    Bursts of file events, e.g. from a package install, are coalesced into a single report.
+    Requires GLib and Gio to be imported first, by load_gui() or the daemon.
+    """
+    # Milliseconds to wait for more file events before reporting the changed applications
+    delay = 500
+
+    def __init__(self, callback):
+        """
+        :param callback: Called with the set of changed appids, returns False to be called again after the delay.
+        """
+        self.callback = callback
+        self.pending = set()
+        self.source = None
+        self.monitors = []
+
+        # File events that can change an application
+        self.events = (Gio.FileMonitorEvent.CREATED, Gio.FileMonitorEvent.DELETED,
+                       Gio.FileMonitorEvent.CHANGES_DONE_HINT, Gio.FileMonitorEvent.MOVED_IN,
+                       Gio.FileMonitorEvent.MOVED_OUT, Gio.FileMonitorEvent.RENAMED)
+
+        for data_dir in xdg.BaseDirectory.xdg_data_dirs:
+            self.monitor(os.path.join(data_dir, "applications"))
+
+    def monitor(self, app_dir, prefix="", parents=frozenset()):
+        """
+        Monitor the given directory and its existing subdirectories, prefix is the desktop id prefix of the files.
+        Symlinked subdirectories are followed, except those that link back to one of the parents, see ScanIndex.
+        """
+        try:
+            stat = os.stat(app_dir)
+        except OSError:
+            pass
+        else:
+            if (stat.st_dev, stat.st_ino) in parents:
+                return
+            parents = parents | {(stat.st_dev, stat.st_ino)}
+
+        try:
+            monitor = Gio.File.new_for_path(app_dir).monitor_directory(Gio.FileMonitorFlags.WATCH_MOVES, None)
+        except GLib.Error as e:
+            logger.debug("Unable to monitor directory: %s", app_dir)
+            logger.debug(e)
+            return
+
+        monitor.connect("changed", self.on_changed, prefix)
+        self.monitors.append(monitor)
+
+        # Directories that don't exist yet are still monitored, for when they are created
+        try:
+            with os.scandir(app_dir) as entries:
+                sub_dirs = [entry.name for entry in entries if entry.is_dir()]
+        except OSError:
+            sub_dirs = []
+
+        for sub_dir in sub_dirs:
+            self.monitor(os.path.join(app_dir, sub_dir), prefix + sub_dir + "-", parents)
+
+    def on_changed(self, _, changed_file, other_file, event_type, prefix):
+        if event_type not in self.events:
+            return
+
+        # Queue the changed applications, a renamed file changes two applications
+        for gfile in (changed_file, other_file):
+            basename = gfile.get_basename() if gfile else None
+            if basename and basename.endswith(".desktop"):
+                self.pending.add((prefix + basename).rsplit(".", 1)[0].lower())
+
+        # Restart the delay on every event, so a burst of events is only reported once
+        if self.pending:
+            if self.source:
+                GLib.source_remove(self.source)
+            self.source = GLib.timeout_add(self.delay, self.on_timeout)
+
+    def on_timeout(self):
+        appids = set(self.pending)
+        if not self.callback(appids):
+            return True
+
+        self.source = None
+        self.pending -= appids
+        return False
+
+
+def daemon_socket_path():
+    """Return the path to the unix socket of the daemon"""
+    return os.path.join(xdg.BaseDirectory.get_runtime_dir(strict=False), "apphide.sock")
+
+
+def daemon_environment():
+    """Return the settings that must match between the daemon and a client, for the daemon to serve it"""
+    return {"data_dirs": xdg.BaseDirectory.xdg_data_dirs, "langs": xdg.Locale.langs, "desktop": DESKTOP}
+
+
+def request_daemon(argv):
+    """
+    Run the given command line arguments by the running daemon.
+    Returns the daemon's response, or None if no daemon is running or it can't serve this client.
+    """
+    socket_path = daemon_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+
+    request = {"argv": argv, "environment": daemon_environment()}
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            # A daemon that is stuck or stopped must never block the client, it runs in-process instead
+            sock.settimeout(DAEMON_ACCEPT_TIMEOUT)
+            sock.connect(socket_path)
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            sock.shutdown(socket.SHUT_WR)
+            if sock.recv(1) != b"\n":
+                raise ValueError("Request was not accepted by the daemon")
+
+            # The daemon is running the request, running it again in-process could apply a toggle twice
+            sock.settimeout(DAEMON_RESPONSE_TIMEOUT)
+            try:
+                with sock.makefile("r", encoding="utf-8") as stream:
+                    response = json.load(stream)
+            except (OSError, ValueError) as e:
+                logger.error("Daemon failed to respond: %s", e)
+                return {"output": "", "exit_status": 1}
+    except (OSError, ValueError) as e:
+        logger.debug("Unable to use daemon, falling back to in-process: %s", e)
+        return None
+
+    return None if response.get("fallback") else response
+
+
+@contextmanager
+def capture_output(output):
+    """Write the log messages to the given stream instead of the console, while within the context"""
+    handler = logging.StreamHandler(output)
+    logger.removeHandler(consoleHandler)
+    logger.addHandler(handler)
+    try:
+        yield
+    finally:
+        logger.removeHandler(handler)
+        logger.addHandler(consoleHandler)
+
+
+class AppDaemon(object):
+    """
+    Resident daemon that keeps all applications and the tracker loaded in memory.
+    Command line calls are served over a unix socket, so they skip startup and scanning.
+    Applications are refreshed from file monitors, the same way as the GUI.
+    """
+
     def __init__(self):
-        self.args = args = self.parse_args()
+        self.xdg_apps = get_xdg_apps()
+        self.environment = daemon_environment()
+        self.watcher = None
+
+    def serve(self):
+        """
+        Serve requests until the daemon is stopped with SIGINT or SIGTERM.
+        Returns False if another daemon is already running.
+        """
+        global GLib, Gio
+        from gi.repository import GLib
+        from gi.repository import Gio
+
+        # Refuse to replace the socket of another running daemon
+        socket_path = daemon_socket_path()
+        if os.path.exists(socket_path):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                if sock.connect_ex(socket_path) == 0:
+                    logger.error("Daemon is already running: %s", socket_path)
+                    return False
+            os.remove(socket_path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        os.chmod(socket_path, 0o600)
+        server.listen()
+
+        self.watcher = AppWatcher(self.refresh_apps)
+        GLib.io_add_watch(server.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, self.on_incoming, server)
+
+        loop = GLib.MainLoop()
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGINT, loop.quit)
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGTERM, loop.quit)
+        logger.info("Daemon listening on: %s", socket_path)
+        try:
+            loop.run()
+        finally:
+            server.close()
+            os.remove(socket_path)
+        return True
+
+    def on_incoming(self, _, __, server):
+        connection, _ = server.accept()
+        with connection:
+            connection.settimeout(5)
+            try:
+                with connection.makefile("r", encoding="utf-8") as stream:
+                    line = stream.readline()
+
+                # Empty requests are only used to check if the daemon is running
+                if line:
+                    # Let the client know the request is being run, so it won't fall back to running it itself
+                    request = json.loads(line)
+                    connection.sendall(b"\n")
+                    response = self.handle(request)
+                    connection.sendall(json.dumps(response).encode("utf-8"))
+            except (OSError, ValueError) as e:
+                logger.error("Failed to serve request: %s", e)
+        return True
+
+    def handle(self, request):
+        """Run the requested command line arguments against the loaded applications"""
+        # The client has to fall back if it would see other applications than the daemon
+        if request.get("environment") != self.environment:
+            return {"fallback": True}
+
+        # Other processes may have changed the tracker since the last request
+        if XDGManager._tracker is not None:
+            XDGManager._tracker.load()
+
+        # Capture the output that would be printed by the client, instead of printing it here
+        output = io.StringIO()
+        try:
+            with capture_output(output):
+                cli = CLIManager(request["argv"], self.xdg_apps, output)
+        except SystemExit:
+            # Invalid arguments, let the client report them itself
+            return {"fallback": True}
+
+        return {"output": output.getvalue(), "exit_status": cli.exit_status}
+
+    def refresh_apps(self, appids):
+        """Re-parse only the changed applications"""
+        try:
+            changed = get_xdg_apps(appids=appids)
+        except Exception:
+            logger.exception("Failed to refresh aplication data.")
+            return True
+
+        xdg_apps = [xdg_app for xdg_app in self.xdg_apps if xdg_app.appid not in appids] + changed
+        self.xdg_apps = AppList(sorted(xdg_apps, key=lambda data: data.sort_key))
+        return True
+
+
+class Fleet(object):
+    """
+    Run command line calls against the home directories of many users.
+    The shared system directories are scanned once, then every home is processed by its own worker process.
+    Workers are forked, so they inherit the scanned system applications and the parsed fields of their files.
+    When run as root, each worker switches to the owner of its home, so created files belong to that user.
+
+    Only the default xdg directories of each home are used, as the environment of other users is unknown.
+    """
+    _index = None
+
+    def __init__(self, homes, workers=None):
+        """
+        :param homes: The home directories to process.
+        :param workers: Max number of worker processes, defaults to the number of CPUs.
+        """
+        self.homes = [os.path.abspath(home) for home in homes]
+        self.workers = workers or None
+
+    def run(self, argv):
+        """Run the given command line arguments for each home, yielding the result of each home in order."""
+        import multiprocessing
+
+        # Scan the system directories up front, so the workers only have to scan the directories of their user
+        index = ScanIndex()
+        with profiler.span("fleet.scan"):
+            system_files = []
+            for data_dir in xdg.BaseDirectory.xdg_data_dirs:
+                if not within_dir(data_dir, os.path.expanduser("~")):
+                    found = index.listdir(os.path.join(data_dir, "applications"))
+                    system_files.extend(app_path for _, app_path in found)
+            index.preload(system_files)
+            index.save()
+
+        # Each worker only processes one home, as it may have switched to the user of that home
+        context = multiprocessing.get_context("fork")
+        with context.Pool(self.workers, self.init_worker, (index,), maxtasksperchild=1) as pool:
+            results = [pool.apply_async(self.process_home, (home, argv)) for home in self.homes]
+            for result in results:
+                yield result.get()
+
+    @classmethod
+    def init_worker(cls, index):
+        """Keep the scan index that was inherited from the parent process"""
+        cls._index = index
+
+    @classmethod
+    def process_home(cls, home, argv):
+        """Run the command line arguments against the given home, within a worker process"""
+        output = io.StringIO()
+        exit_status = 1
+        with capture_output(output):
+            try:
+                cls.switch_home(home)
+            except OSError as e:
+                logger.error("Failed to switch to home: %s", e)
+                return {"home": home, "output": output.getvalue(), "exit_status": exit_status}
+
+            try:
+                cli = CLIManager(argv, get_xdg_apps(workers=0, index=cls._index), output, home)
+                exit_status = cli.exit_status
+            except Exception:
+                logger.exception("Failed to process home: %s", home)
+        return {"home": home, "output": output.getvalue(), "exit_status": exit_status}
+
+    @staticmethod
+    def switch_home(home):
+        """Point the user's xdg directories and the tracker at the given home, and run as its owner"""
+        stat = os.stat(home)
+        if os.geteuid() == 0 and stat.st_uid != 0:
+            os.setgroups([])
+            os.setgid(stat.st_gid)
+            os.setuid(stat.st_uid)
+
+        # User data directories, like the user's flatpak exports, are moved along with the home
+        current_home = os.path.expanduser("~")
+        data_home = os.path.join(home, ".local", "share")
+        data_dirs = []
+        for data_dir in xdg.BaseDirectory.xdg_data_dirs:
+            if within_dir(data_dir, xdg.BaseDirectory.xdg_data_home):
+                data_dir = data_home + data_dir[len(xdg.BaseDirectory.xdg_data_home):]
+            elif within_dir(data_dir, current_home):
+                data_dir = home + data_dir[len(current_home):]
+            data_dirs.append(data_dir)
+
+        os.environ["HOME"] = home
+        xdg.BaseDirectory.xdg_data_home = data_home
+        xdg.BaseDirectory.xdg_data_dirs = data_dirs
+        xdg.BaseDirectory.xdg_config_home = os.path.join(home, ".config")
+        xdg.BaseDirectory.xdg_cache_home = os.path.join(home, ".cache")
+
+        config_dir = os.path.join(xdg.BaseDirectory.xdg_config_home, "apphide")
+        Tracker.set_config_dir(config_dir)
+        ScanIndex._index_file = os.path.join(config_dir, "index.json")
+        XDGManager._tracker = None
+
+
+class CLIManager(object):
+    def __init__(self, argv=None, xdg_apps=None, stream=None, home=None):
+        """
+        :param argv: Command line arguments, defaults to sys.argv.
+        :param xdg_apps: Already loaded applications to use, used by the daemon.
+        :param stream: Stream to write formatted records to, defaults to sys.stdout.
+        :param home: Home directory that is processed as part of --homes, added to each formatted record.
+        """
+        self.args = args = self.parse_args(argv)
+        self.stream = stream or sys.stdout
+        self.home = home
         self.exit_status = 0
 
+        # Requests served by the daemon are never profiled, as it reports on exit
+        if args.profile and xdg_apps is None:
+            profiler.enable(args.profile)
+
+        if args.daemon:
+            self.run_daemon()
+            return
+
+        # The workers run the same arguments against the applications of their home
+        elif args.homes and xdg_apps is None:
+            self.run_fleet(sys.argv[1:] if argv is None else argv)
+            return
+
+        # Garbage is always collected in-process, the daemon never shows leftovers anyway
+        elif args.gc:
+            self.run_gc()
+            return
+
+        # Let a running daemon serve the command, unless the client has to do the work itself
+        # Profiles are read and written in-process, as the daemon may have another working directory
+        elif xdg_apps is None and not (args.no_daemon or args.rebuild_index or args.profile or
+                                       args.export_profile or args.apply_profile):
+            response = request_daemon(sys.argv[1:] if argv is None else argv)
+            if response is not None:
+                sys.stdout.write(response["output"])
+                self.exit_status = response["exit_status"]
+                return
+
+        # Only the specified application needs to be loaded when changing its state, unless a query is given
+        appid = None if args.list else args.show or args.hide or args.toggle
+        appids = {appid.lower()} if appid and not self.query_args() else None
+
         try:
             # Fetch all applications
-            self.xdg_apps = get_xdg_apps()
+            if xdg_apps is None:
+                xdg_apps = get_xdg_apps(args.rebuild_index, args.workers or 0, args.processes, appids)
+            self.xdg_apps = xdg_apps
         except Exception:
             msg = "Failed to read aplication data. Sorry."
             self.exit_status = 1
@@ -606,25 +1735,77 @@ class CLIManager(object):
             # Execute commandline options
             if args.list:
                 self.list_apps()
-            elif args.show:
+            elif args.show is not None:
                 self.change_state(args.show.lower(), False)
-            elif args.hide:
+            elif args.hide is not None:
                 self.change_state(args.hide.lower(), True)
-            elif args.toggle:
+            elif args.toggle is not None:
                 self.change_state(args.toggle.lower())
+            elif args.export_profile:
+                self.export_profile(args.export_profile)
+            elif args.apply_profile:
+                self.apply_profile(args.apply_profile)
+
+    def run_daemon(self):
+        try:
+            if not AppDaemon().serve():
+                self.exit_status = 1
+        except Exception:
+            self.exit_status = 1
+            logger.exception("Failed to run daemon.")
+
+    def run_fleet(self, argv):
+        failed = 0
+        try:
+            # The headers go to stderr, so the formatted records of all homes can be parsed from stdout
+            for result in Fleet(self.args.homes, self.args.workers).run(argv):
+                sys.stderr.write("==> %s <==\n" % result["home"])
+                sys.stderr.flush()
+                self.stream.write(result["output"])
+                self.stream.flush()
+                if result["exit_status"]:
+                    failed += 1
+        except Exception:
+            self.exit_status = 1
+            logger.exception("Failed to process homes.")
+            return
+
+        sys.stderr.write("Processed %d homes, %d failed\n" % (len(self.args.homes), failed))
+        if failed:
+            self.exit_status = 1
+
+    def run_gc(self):
+        try:
+            leftovers, missing = collect_garbage(self.args.dry_run)
+        except Exception:
+            self.exit_status = 1
+            logger.exception("Failed to collect garbage.")
+            return
+
+        action = "Would remove" if self.args.dry_run else "Removed"
+        for filepath in leftovers:
+            logger.info("%s leftover file: %s", action, filepath)
+        for filepath in missing:
+            logger.info("%s missing file from tracker: %s", action, filepath)
+        logger.info("%s %d leftover files and %d missing tracked files", action, len(leftovers), len(missing))
 
     @staticmethod
-    def parse_args():
+    def parse_args(argv=None):
         # Create Parser to parse the required arguments
         parser = ArgumentParser(description="Hide applications from the gnome overview.")
 
+        # The id can be left out of the change options, to change all applications that match the query
         change_group = parser.add_mutually_exclusive_group()
-        change_group.add_argument("-s", "--show", action="store", metavar="id",
+        change_group.add_argument("-s", "--show", action="store", nargs="?", const="", metavar="id",
                                   help="UnHide the specified application")
-        change_group.add_argument("-i", "--hide", action="store", metavar="id",
+        change_group.add_argument("-i", "--hide", action="store", nargs="?", const="", metavar="id",
                                   help="Hide the specified application")
-        change_group.add_argument("-t", "--toggle", action="store", metavar="id",
+        change_group.add_argument("-t", "--toggle", action="store", nargs="?", const="", metavar="id",
                                   help="Toggle the Hide/Show state for specified application")
+        change_group.add_argument("--export-profile", nargs="?", const="-", default=None, metavar="FILE",
+                                  help="Save the hidden applications as a profile, to stdout if FILE is not given")
+        change_group.add_argument("--apply-profile", default=None, metavar="FILE",
+                                  help="Hide the applications of the profile and show all others")
 
         list_group = parser.add_argument_group()
         list_group.add_argument("-l", "--list", default=False, action="store_true",
@@ -638,15 +1819,97 @@ class CLIManager(object):
 
         list_group.add_argument("-o", "--no-headers", default=False, action="store_true",
                                 help="Cleaner output for easier parsing")
+        list_group.add_argument("-f", "--format", choices=("json", "ndjson", "tsv"), default=None,
+                                help="Write machine readable records instead of a table")
+
+        query_group = parser.add_argument_group("query", "Select the applications to list or change, "
+                                                         "repeat an option to match any of its values")
+        query_group.add_argument("--id", action="append", default=[], dest="ids", metavar="PATTERN",
+                                 help="Match the appid against a glob pattern")
+        query_group.add_argument("--name", action="append", default=[], dest="names", metavar="PATTERN",
+                                 help="Match the name against a glob pattern")
+        query_group.add_argument("--regex", default=False, action="store_true",
+                                 help="Use regular expressions for --id and --name instead of glob patterns")
+        query_group.add_argument("--category", action="append", default=[], dest="categories", metavar="NAME",
+                                 help="Match applications within the category")
+        query_group.add_argument("--keyword", action="append", default=[], dest="keywords", metavar="WORD",
+                                 help="Match applications with the keyword")
+        query_group.add_argument("--exec", action="append", default=[], dest="execs", metavar="PATTERN",
+                                 help="Match a word of the Exec command against a glob pattern, "
+                                      "paths also match by file name")
+        query_group.add_argument("--origin", action="append", default=[], dest="origins",
+                                 choices=AppIndex.origins, help="Match applications loaded from this origin")
+
+        parser.add_argument("-r", "--rebuild-index", default=False, action="store_true",
+                            help="Ignore the stored scan index and parse all applications again")
+        parser.add_argument("-w", "--workers", default=None, type=int, metavar="N",
+                            help="Number of workers used to parse and change applications, "
+                                 "applications are parsed one at a time unless this is given")
+        parser.add_argument("--processes", default=False, action="store_true",
+                            help="Parse applications using a pool of processes, for very large trees")
+        parser.add_argument("--gc", default=False, action="store_true",
+                            help="Remove leftover files of uninstalled applications")
+        parser.add_argument("--dry-run", default=False, action="store_true",
+                            help="Only report what would be changed")
+        parser.add_argument("--profile", nargs="?", const="-", default=None, metavar="FILE",
+                            help="Report the time spent in each phase on exit, as json if FILE is given")
+
+        parser.add_argument("--homes", nargs="+", default=None, metavar="HOME",
+                            help="Run against the default xdg directories of each home, using parallel processes")
+
+        daemon_group = parser.add_mutually_exclusive_group()
+        daemon_group.add_argument("--daemon", default=False, action="store_true",
+                                  help="Keep applications loaded and serve command line calls over a socket")
+        daemon_group.add_argument("--no-daemon", default=False, action="store_true",
+                                  help="Run in-process even if a daemon is running")
         # Parse All Args
-        return parser.parse_args()
+        args = parser.parse_args(argv)
+        query = args.ids or args.names or args.categories or args.keywords or args.execs or args.origins
+        if "" in (args.show, args.hide, args.toggle) and not query:
+            parser.error("an application id or a query option is required")
+        if args.homes and args.daemon:
+            parser.error("argument --homes: not allowed with argument --daemon")
+        if args.homes and args.export_profile not in (None, "-"):
+            parser.error("argument --export-profile: FILE is not allowed with argument --homes, "
+                         "the profile of each home is written to stdout")
+        return args
+
+    def query_args(self):
+        """Return the query options that were given as keyword arguments for :meth:`AppIndex.query`"""
+        args = self.args
+        predicates = {"ids": args.ids, "names": args.names, "categories": args.categories,
+                      "keywords": args.keywords, "execs": args.execs, "origins": args.origins}
+        return {key: values for key, values in predicates.items() if values}
+
+    def select_apps(self, appid=None):
+        """Return the applications selected by the given appid, the query options and the hidden filter"""
+        predicates = self.query_args()
+        if predicates:
+            xdg_apps = self.xdg_apps.query(regex=self.args.regex, **predicates)
+        else:
+            xdg_apps = self.xdg_apps
+
+        if appid:
+            xdg_apps = [xdg_app for xdg_app in xdg_apps if xdg_app.appid == appid]
+
+        # Check if the list needs filtering
+        if self.args.nodisplay is not None:
+            xdg_apps = [xdg_app for xdg_app in xdg_apps if xdg_app.nodisplay is self.args.nodisplay]
+        return xdg_apps
 
     def list_apps(self):
+        xdg_apps = self.select_apps()
+
+        # Machine readable records are streamed straight out, without calculating column widths
+        if self.args.format:
+            self.write_records(xdg_apps)
+            return
+
         # Calculate the max length of the Name colume
         # Base on the length of the longest name
         max_name_len = 0
         max_dec_len = 0
-        for xdg_app in self.xdg_apps:
+        for xdg_app in xdg_apps:
             len_of_name = len(xdg_app.name)
             len_of_dec = len(xdg_app.description)
 
@@ -665,12 +1928,6 @@ class CLIManager(object):
             logger.info(layout, "Hidden", "Name".ljust(max_name_len), "Description".ljust(max_dec_len), "AppID")
             logger.info("-" * (max_name_len + 20 + max_dec_len))
 
-        # Check if the list needs filtering
-        if self.args.nodisplay is not None:
-            xdg_apps = (xdg_app for xdg_app in self.xdg_apps if xdg_app.nodisplay is self.args.nodisplay)
-        else:
-            xdg_apps = self.xdg_apps
-
         # Print each application in a newline
         for xdg_app in xdg_apps:
             hidden = ("Yes" if xdg_app.nodisplay else "No").ljust(6)
@@ -678,41 +1935,732 @@ class CLIManager(object):
             name = xdg_app.name.ljust(max_name_len)
             logger.info(layout, hidden, name, description, xdg_app.appid)
 
+    def write_records(self, xdg_apps):
+        """Write one record per given application to the stream, in the requested format"""
+        fields = ("appid", "name", "description", "hidden", "origin", "paths") + (("home",) if self.home else ())
+        fmt = self.args.format
+        stream = self.stream
+
+        if fmt == "json":
+            stream.write("[")
+        elif fmt == "tsv" and not self.args.no_headers:
+            stream.write("\t".join(fields) + "\n")
+
+        separator = ""
+        for xdg_app in xdg_apps:
+            if fmt == "tsv":
+                values = (xdg_app.appid, xdg_app.name, xdg_app.description, "true" if xdg_app.nodisplay else "false",
+                          xdg_app.origin, ":".join(xdg_app.xdg_files)) + ((self.home,) if self.home else ())
+                stream.write("\t".join(self.escape_tsv(value) for value in values) + "\n")
+            else:
+                record = {"appid": xdg_app.appid, "name": xdg_app.name, "description": xdg_app.description,
+                          "hidden": xdg_app.nodisplay, "origin": xdg_app.origin, "paths": xdg_app.xdg_files}
+                if self.home:
+                    record["home"] = self.home
+                if fmt == "json":
+                    stream.write(separator + json.dumps(record))
+                    separator = ",\n"
+                else:
+                    stream.write(json.dumps(record) + "\n")
+
+        if fmt == "json":
+            stream.write("]\n")
+        stream.flush()
+
+    @staticmethod
+    def escape_tsv(value):
+        """Escape the characters that would break a tsv field"""
+        return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+    def export_profile(self, filepath):
+        """Write the appids of the hidden applications, out of the selected applications, as a json profile"""
+        profile = {"hidden": sorted(xdg_app.appid for xdg_app in self.select_apps() if xdg_app.nodisplay)}
+        if filepath == "-":
+            json.dump(profile, self.stream, indent=4)
+            self.stream.write("\n")
+        else:
+            try:
+                with open(filepath, "w") as stream:
+                    json.dump(profile, stream, indent=4)
+                    stream.write("\n")
+            except OSError as e:
+                self.exit_status = 1
+                logger.error("Failed to save profile: %s", e)
+
+    def apply_profile(self, filepath):
+        """
+        Hide the applications within the profile and show all other selected applications.
+        Only the applications whose state differs are changed, in parallel.
+
+        Each change is committed to the tracker on its own, while the user file of the application is locked,
+        so other processes never see a changed file that isn't tracked yet. A failed change doesn't undo
+        the changes that were already made, they are reported and can be completed by applying the profile again.
+        """
+        try:
+            with open(filepath, "r") as stream:
+                hidden = {appid.lower() for appid in json.load(stream)["hidden"]}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            self.exit_status = 1
+            logger.error("Failed to load profile: %s", e)
+            return
+
+        xdg_apps = self.select_apps()
+        changes = [(xdg_app, xdg_app.appid in hidden) for xdg_app in xdg_apps
+                   if xdg_app.nodisplay != (xdg_app.appid in hidden)]
+        for appid in sorted(hidden - {xdg_app.appid for xdg_app in xdg_apps}):
+            logger.info("Application within profile is not available: %s", appid)
+
+        if self.args.dry_run:
+            for xdg_app, state in changes:
+                logger.info("Would %s application: %s", "hide" if state else "show", xdg_app.name)
+        elif changes:
+            workers = None if self.args.workers is None else max(self.args.workers, 1)
+            # Load the tracker up front, so it's shared by the worker threads
+            XDGManager.get_tracker()
+            with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+                futures = {executor.submit(xdg_app.set_nodisplay, state): (xdg_app, state)
+                           for xdg_app, state in changes}
+                # Only count the applications that were changed by this process
+                changes = []
+                for future in concurrent.futures.as_completed(futures):
+                    xdg_app, state = futures[future]
+                    if future.exception():
+                        logger.error("Failed to %s application %s", "Hide" if state else "Show", xdg_app.appid)
+                        logger.error(future.exception())
+                        self.exit_status = 1
+                    elif future.result():
+                        changes.append((xdg_app, state))
+
+        hide_count = sum(1 for _, state in changes if state)
+        logger.info("%s %d applications and %s %d applications", "Would hide" if self.args.dry_run else "Hid",
+                    hide_count, "show" if self.args.dry_run else "showed", len(changes) - hide_count)
+
     def change_state(self, appid, value=None):
-        # Search for spicified app
-        for xdg_app in self.xdg_apps:
-            if xdg_app.appid == appid:
-                current_value = xdg_app.nodisplay
+        # Search for spicified app, or all apps that match the query
+        xdg_apps = self.select_apps(appid)
+        if not xdg_apps:
+            if appid:
+                logger.error("Unable to find specified application: %s", appid)
+            else:
+                logger.error("No applications match the query")
+
+        for xdg_app in xdg_apps:
+            current_value = xdg_app.nodisplay
+            if self.args.dry_run:
+                state = not current_value if value is None else value
+                if state == current_value:
+                    logger.info("Application %s is allready set to %s", xdg_app.name, "hide" if state else "show")
+                else:
+                    logger.info("Would %s application: %s", "hide" if state else "show", xdg_app.name)
+                continue
+
+            try:
+                # Toggle nodisplay if no value is given
+                if value is None:
+                    xdg_app.nodisplay = not current_value
+
+                # The state is checked again when changing it, as another process may have changed it
+                elif not xdg_app.set_nodisplay(value):
+                    logger.info("Application %s is allready set to %s", xdg_app.name, "hide" if value else "show")
+
+            except Exception as e:
+                logger.error("Failed to %s application %s", "Hide" if value else "Show", xdg_app.appid)
+                self.exit_status = 1
+                logger.error(e)
+
+
+# GObject modules, these are only imported by load_gui() when the GUI is launched
+Gtk = Gio = GLib = Pango = GdkPixbuf = None
+
+
+def load_gui():
+    """
+    Import Gtk and define the GUI classes. This is only done when the GUI is launched,
+    so the command line never has to load the GObject typelibs or need a display.
+    Returns the GUI application class.
+    """
+    global Gtk, Gio, GLib, Pango, GdkPixbuf
+
+    # Import Gtk 3.0 Specifically
+    import gi
+    gi.require_version("Gtk", "3.0")
+    from gi.repository import Gtk
+    from gi.repository import Gio
+    from gi.repository import GLib
+    from gi.repository import Pango
+    from gi.repository import GdkPixbuf
+
+    class AppHideApp(Gtk.Application):
+        def __init__(self):
+            super().__init__(application_id="org.apphide.py", flags=Gio.ApplicationFlags.FLAGS_NONE)
+            self.window = None
+
+        def do_activate(self):
+            if not self.window:
+                self.window = AppHideWin(application=self, title="AppHide")
+                self.window.connect("delete-event", self.on_quit)
+                self.window.show_all()
+            self.window.present()
+
+        def on_quit(self, *_):
+            self.window.icon_loader.shutdown()
+            if self.window.row_changed:
+                self.info_dialog()
+            self.quit()
+
+        def info_dialog(self):
+            """Display a error dialog when unable to hide/unhide an application"""
+            dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.INFO, Gtk.ButtonsType.OK, "Action Required")
+            dialog.format_secondary_text("You may need to logout and login again for change to take effect")
+            dialog.run()
+            dialog.destroy()
+
+    class AppHideWin(Gtk.ApplicationWindow):
+        # Columns of the application store, the visible columns combine the search with the hidden state
+        (COL_APP, COL_ICON_NAME, COL_PIXBUF, COL_NAME, COL_DESCRIPTION, COL_HIDDEN,
+         COL_VISIBLE, COL_VISIBLE_HIDDEN, COL_VISIBLE_SHOWN) = range(9)
+
+        # Max number of applications added to the store per main loop iteration
+        batch_size = 100
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.set_default_icon_name(DEFAULT_ICON)
+            self.set_default_size(860, 800)
+            self.icon_loader = IconLoader()
+            self.filter_by = None
+            self.query = ""
+            self.matches = set()
+
+            # The outer box to store the filter box and scrolledwindow
+            outer_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+            outer_box.set_halign(Gtk.Align.CENTER)
+            self.add(outer_box)
+
+            # Filter box to store the filter radio button
+            filter_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+            filter_box.set_halign(Gtk.Align.CENTER)
+            filter_box.set_valign(Gtk.Align.START)
+            outer_box.add(filter_box)
+
+            # All Radio Button
+            btn_filter_all = Gtk.RadioButton.new_with_label_from_widget(None, "All")
+            btn_filter_all.connect("toggled", self.on_radio_toggled, None)
+            btn_filter_all.set_tooltip_text("Show all applications")
+            filter_box.pack_start(btn_filter_all, False, False, 0)
+
+            # Hidden Radio Button
+            btn_filter_hidden = Gtk.RadioButton.new_with_label_from_widget(btn_filter_all, "Hidden")
+            btn_filter_hidden.connect("toggled", self.on_radio_toggled, "Hidden")
+            btn_filter_hidden.set_tooltip_text("Show only hidden applications")
+            filter_box.pack_start(btn_filter_hidden, False, False, 0)
+
+            # UnHidden Radio Button
+            btn_filter_unhidden = Gtk.RadioButton.new_with_label_from_widget(btn_filter_all, "Not Hidden")
+            btn_filter_unhidden.connect("toggled", self.on_radio_toggled, "UnHidden")
+            btn_filter_unhidden.set_tooltip_text("Show only unhidden applications")
+            filter_box.pack_start(btn_filter_unhidden, False, False, 0)
+
+            # Search entry, matched against the search text of each application
+            search_entry = Gtk.SearchEntry()
+            search_entry.set_placeholder_text("Search applications")
+            search_entry.set_width_chars(30)
+            search_entry.connect("search-changed", self.on_search_changed)
+            filter_box.pack_start(search_entry, False, False, 12)
+
+            # Spinner to show while the applications are loading
+            self.spinner = Gtk.Spinner()
+            self.spinner.set_tooltip_text("Loading applications")
+            filter_box.pack_start(self.spinner, False, False, 0)
+
+            # Scrolledwindow to scroll through all applications
+            scrolledwindow = Gtk.ScrolledWindow()
+            scrolledwindow.set_hexpand(False)
+            scrolledwindow.set_vexpand(True)
+            scrolledwindow.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+            self.scroll_adj = scrolledwindow.get_vadjustment()
+            outer_box.add(scrolledwindow)
+
+            # Store of all applications, the All, Hidden and Not Hidden filters are precomputed
+            # filtered models that use a boolean column, so no python is called per row
+            self.store = Gtk.ListStore(object, str, GdkPixbuf.Pixbuf, str, str, bool, bool, bool, bool)
+            self.models = {None: self.store.filter_new(),
+                           "Hidden": self.store.filter_new(),
+                           "UnHidden": self.store.filter_new()}
+            self.models[None].set_visible_column(self.COL_VISIBLE)
+            self.models["Hidden"].set_visible_column(self.COL_VISIBLE_HIDDEN)
+            self.models["UnHidden"].set_visible_column(self.COL_VISIBLE_SHOWN)
+
+            # Treeview to list all applications, rows are only rendered when they are visible
+            self.treeview = Gtk.TreeView(model=self.models[None])
+            self.treeview.set_size_request(860, -1)
+            self.treeview.set_headers_visible(False)
+            self.treeview.set_enable_search(False)
+            self.treeview.set_grid_lines(Gtk.TreeViewGridLines.HORIZONTAL)
+            self.treeview.get_selection().set_mode(Gtk.SelectionMode.NONE)
+            self.treeview.connect("row-activated", self.on_row_activated)
+            scrolledwindow.add(self.treeview)
+
+            # Icon
+            icon_size = Gtk.icon_size_register("apphide-icon", IconLoader.size, IconLoader.size)
+            renderer = Gtk.CellRendererPixbuf(stock_size=icon_size, xpad=16, ypad=16)
+            column = self.add_column(renderer, 96)
+            column.set_cell_data_func(renderer, self.icon_data_func)
+
+            # Name
+            renderer = WrapedCellRenderer(wrap_width=165)
+            self.add_column(renderer, 181, text=self.COL_NAME)
+
+            # Description
+            renderer = WrapedCellRenderer(wrap_width=400, xpad=16)
+            self.add_column(renderer, 448, text=self.COL_DESCRIPTION)
+
+            # Hidden toggle
+            renderer = Gtk.CellRendererToggle(xpad=24)
+            renderer.connect("toggled", self.on_hide_toggled)
+            self.add_column(renderer, 100, active=self.COL_HIDDEN)
+
+            # All rows have the same height, as the text cells always request the height of 3 lines,
+            # so the treeview does not need to measure every row
+            self.treeview.set_fixed_height_mode(True)
+
+            # Fetch list of all applications in the background, so the window can be shown right away
+            self.row_changed = False
+            self.rows = {}
+            self.loading = True
+            self.spinner.start()
+            self.watcher = AppWatcher(self.refresh_apps)
+            threading.Thread(target=self.load_apps, daemon=True).start()
+
+        def load_apps(self):
+            """Fetch list of all applications sorted by name, this runs in a background thread"""
+            try:
+                xdg_apps = get_xdg_apps()
+            except Exception as e:
+                logger.exception("Failed to read aplication data. Sorry.")
+                GLib.idle_add(self.on_load_failed, e)
+            else:
+                GLib.idle_add(self.add_apps, iter(xdg_apps))
+
+        def on_load_failed(self, error):
+            self.loading = False
+            self.spinner.stop()
+            self.error_dialog("Failed to read aplication data. Sorry.", error)
+            self.get_application().quit()
+
+        def add_apps(self, xdg_apps):
+            """
+            Add the next batch of applications to the store, so the main loop stays responsive.
+            Returns True while there are more applications to add, to be called again when idle.
+            """
+            added = 0
+            for xdg_app in itertools.islice(xdg_apps, self.batch_size):
+                self.add_app(xdg_app)
+                added += 1
+
+            if added < self.batch_size:
+                self.loading = False
+                self.spinner.stop()
+                self.spinner.hide()
+
+                # Leftover files are removed once everything is shown, so they never delay startup
+                GLib.idle_add(self.run_gc, priority=GLib.PRIORITY_LOW)
+                return False
+            return True
+
+        def run_gc(self):
+            try:
+                collect_garbage()
+            except Exception:
+                logger.exception("Failed to remove leftover files.")
+            return False
+
+        def refresh_apps(self, appids):
+            """Re-parse only the changed applications and add, remove or update their rows"""
+            # Check again later if the initial load has not finished yet
+            if self.loading:
+                return False
+
+            try:
+                xdg_apps = {xdg_app.appid: xdg_app for xdg_app in get_xdg_apps(appids=appids)}
+            except Exception:
+                logger.exception("Failed to refresh aplication data.")
+                return True
+
+            removed = False
+            for appid in appids:
+                if appid in xdg_apps:
+                    self.update_app(xdg_apps[appid])
+                elif appid in self.rows:
+                    self.remove_app(appid)
+                    removed = True
+
+            # An application that was uninstalled while the GUI is open may have left its user file behind
+            if removed:
+                GLib.idle_add(self.run_gc, priority=GLib.PRIORITY_LOW)
+            return True
+
+        def update_app(self, xdg_app):
+            """Update the row of the given application in place, or add it if it's a new application"""
+            row_ref = self.rows.get(xdg_app.appid)
+            if row_ref is None:
+                self.add_app(xdg_app, self.sorted_position(xdg_app.sort_key))
+                return
+
+            row = self.store[row_ref.get_path()]
+            if row[self.COL_NAME] != xdg_app.name:
+                # Renamed applications have to be moved to keep the list sorted
+                self.remove_app(xdg_app.appid)
+                self.add_app(xdg_app, self.sorted_position(xdg_app.sort_key))
+            else:
+                icon = xdg_app.icon
+                icon_path = self.icon_loader.resolve(icon)
+                row[self.COL_APP] = xdg_app
+                row[self.COL_ICON_NAME] = DEFAULT_ICON if icon_path else icon
+                row[self.COL_PIXBUF] = None
+                row[self.COL_DESCRIPTION] = xdg_app.description
+                self.set_visible(row, xdg_app.nodisplay, self.search(xdg_app))
+                if icon_path:
+                    self.icon_loader.load(icon_path, self.on_icon_loaded, row_ref)
+
+        def remove_app(self, appid):
+            """Remove the row of the given application"""
+            self.matches.discard(appid)
+            row_ref = self.rows.pop(appid)
+            self.store.remove(self.store.get_iter(row_ref.get_path()))
+
+        def sorted_position(self, sort_key):
+            """Return the position to insert an application with the given sort key, to keep the list sorted"""
+            for position, row in enumerate(self.store):
+                if row[self.COL_APP].sort_key > sort_key:
+                    return position
+            return -1
+
+        def add_column(self, renderer, width, **attributes):
+            """Add a fixed width column to the treeview, with the given renderer attributes"""
+            column = Gtk.TreeViewColumn("", renderer, **attributes)
+            column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+            column.set_fixed_width(width)
+            self.treeview.append_column(column)
+            return column
+
+        def icon_data_func(self, _, renderer, model, tree_iter, __):
+            """
+            Show the loaded icon, or the themed icon until it's loaded. Both are image sources of the renderer,
+            setting either one replaces the other, so only the one that is used is set.
+            """
+            pixbuf, icon_name = model.get(tree_iter, self.COL_PIXBUF, self.COL_ICON_NAME)
+            if pixbuf is None:
+                renderer.set_property("icon-name", icon_name)
+            else:
+                renderer.set_property("pixbuf", pixbuf)
+
+        def add_app(self, xdg_app, position=-1):
+            """Add the given application to the store, icon files are loaded in the background"""
+            with profiler.span("gui.add_row"):
+                icon = xdg_app.icon
+                icon_path = self.icon_loader.resolve(icon)
+                hidden = xdg_app.nodisplay
+                matched = self.search(xdg_app)
+                tree_iter = self.store.insert(position, [xdg_app, DEFAULT_ICON if icon_path else icon, None,
+                                                         xdg_app.name, xdg_app.description, hidden,
+                                                         matched, matched and hidden, matched and not hidden])
+
+                row_ref = Gtk.TreeRowReference.new(self.store, self.store.get_path(tree_iter))
+                self.rows[xdg_app.appid] = row_ref
+            if icon_path:
+                self.icon_loader.load(icon_path, self.on_icon_loaded, row_ref)
+
+        def on_icon_loaded(self, pixbuf, row_ref):
+            # The row may have been removed while the icon was loading
+            if row_ref.valid():
+                with profiler.span("gui.set_icon"):
+                    self.store[row_ref.get_path()][self.COL_PIXBUF] = pixbuf
+
+        def search(self, xdg_app, terms=None):
+            """Return True if the application matches all terms of the current query, and keep track of it"""
+            if terms is None:
+                terms = self.query.split()
+
+            matched = all(term in xdg_app.search_text for term in terms)
+            if matched:
+                self.matches.add(xdg_app.appid)
+            else:
+                self.matches.discard(xdg_app.appid)
+            return matched
+
+        def set_visible(self, row, hidden, matched):
+            """Set the hidden state of the row along with the visible columns of the filtered models"""
+            row[self.COL_HIDDEN] = hidden
+            row[self.COL_VISIBLE] = matched
+            row[self.COL_VISIBLE_HIDDEN] = matched and hidden
+            row[self.COL_VISIBLE_SHOWN] = matched and not hidden
+
+        def on_search_changed(self, entry):
+            """
+            Update the rows that started or stopped matching the query.
+            When the query only grew, only the applications that matched before can still match.
+            """
+            query = normalize_text(entry.get_text().strip())
+            if query.startswith(self.query) and self.query:
+                candidates = list(self.matches)
+            else:
+                candidates = list(self.rows)
+
+            terms = query.split()
+            previous = set(self.matches)
+            self.query = query
+            for appid in candidates:
+                row = self.store[self.rows[appid].get_path()]
+                self.search(row[self.COL_APP], terms)
+
+            # Only rows that changed are written to, as every write is checked by the filtered models
+            for appid in previous ^ self.matches:
+                row = self.store[self.rows[appid].get_path()]
+                self.set_visible(row, row[self.COL_HIDDEN], appid in self.matches)
+            self.scroll_adj.set_value(0.0)
+
+        def on_radio_toggled(self, _, filter_by):
+            if not self.filter_by == filter_by:
+                self.filter_by = filter_by
+                self.treeview.set_model(self.models[filter_by])
+                self.scroll_adj.set_value(0.0)
+
+        def error_dialog(self, error_msg, error_obj):
+            """Display a error dialog when unable to hide/unhide an application"""
+            dialog = Gtk.MessageDialog(self, 0, Gtk.MessageType.ERROR, Gtk.ButtonsType.CANCEL, error_msg)
+            dialog.format_secondary_text(str(error_obj))
+            dialog.run()
+            dialog.destroy()
+
+        def store_row(self, path):
+            """Return the store row of the given path, within the current model"""
+            model = self.treeview.get_model()
+            tree_iter = model.convert_iter_to_child_iter(model.get_iter(path))
+            return self.store[tree_iter]
+
+        def on_hide_toggled(self, _, path):
+            row = self.store_row(path)
+            xdg_file = row[self.COL_APP]
+            active = not row[self.COL_HIDDEN]
+            try:
+                xdg_file.nodisplay = active
+            except OSError as e:
+                self.error_dialog("Failed to %s %s" % ("Hide" if active else "Show", xdg_file.name), e)
+            else:
+                # The filtered models update by themselves from the boolean columns
+                self.set_visible(row, active, row[self.COL_VISIBLE])
+                self.row_changed = True
+
+        def on_row_activated(self, _, path, *__):
+            self.on_hide_toggled(None, path)
+
+    class WrapedCellRenderer(Gtk.CellRendererText):
+        """
+        Text renderer that wraps the text over at most 3 lines, and cuts it out at the end of the third line.
+        Gtk.CellRendererText never limits the height of its layout, so it can only ellipsize a single line.
+        The limited layout is measured and rendered here instead, which is only done for the visible rows.
+        """
+        lines = 3
+
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            # Align text to the left side and to the top of the cell
+            self.set_alignment(0.0, 0.0)
+            self.set_property("ypad", 16)
+
+        def create_layout(self, widget, text, width):
+            """Return the layout of the text, wrapped to the given width and ellipsized on the last line"""
+            layout = widget.create_pango_layout(text)
+            layout.set_width(width * Pango.SCALE)
+            layout.set_wrap(Pango.WrapMode.WORD_CHAR)
+            layout.set_ellipsize(Pango.EllipsizeMode.END)
+            # A negative height limits the number of lines
+            layout.set_height(-self.lines)
+            return layout
+
+        def do_get_preferred_height_for_width(self, widget, width):
+            # Every cell is as high as the max number of lines, so all rows have the same height
+            layout = self.create_layout(widget, "\n".join(["X"] * self.lines), max(width, 1))
+            height = layout.get_pixel_size()[1] + 2 * self.get_property("ypad")
+            return height, height
+
+        def do_get_preferred_height(self, widget):
+            return self.do_get_preferred_height_for_width(widget, self.get_property("wrap-width"))
+
+        def do_render(self, cr, widget, _, cell_area, __):
+            xpad, ypad = self.get_property("xpad"), self.get_property("ypad")
+            wrap_width = self.get_property("wrap-width")
+            if wrap_width < 0:
+                wrap_width = cell_area.width - 2 * xpad
+
+            layout = self.create_layout(widget, self.get_property("text") or "", wrap_width)
+            Gtk.render_layout(widget.get_style_context(), cr, cell_area.x + xpad, cell_area.y + ypad, layout)
+
+    class IconLoader(object):
+        """
+        Load icon files off the main thread, the default icon is shown until each icon is ready.
+        Scaled icons are cached on disk keyed by path, so later launches skip decoding the original.
+        The mtime of the original is stored within the cached icon, an updated icon replaces its cached icon.
+
+        Named icons are resolved to a file through the icon theme once. The resolved files are saved
+        and reused until the icon theme, one of the theme directories or a theme's icon cache changes.
+        Icons that are not found are only remembered for the session, as they may be installed later.
+        Icons that are shared by many applications are only loaded once.
+        """
+        _cache_dir = os.path.join(xdg.BaseDirectory.save_cache_path("apphide"), "icons")
+        _paths_file = os.path.join(xdg.BaseDirectory.save_cache_path("apphide"), "icon-paths.json")
+        # PNG text chunk of the cached icon, that holds the mtime of the original
+        _mtime_option = "tEXt::apphide-mtime"
+        size = 64
+
+        def __init__(self, workers=4):
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+            os.makedirs(self._cache_dir, exist_ok=True)
+
+            # Loaded icons and the callbacks that wait on icons that are still loading, by file
+            self._pixbufs = {}
+            self._waiting = {}
+
+            self._theme = Gtk.IconTheme.get_default()
+            self._theme.connect("changed", self.on_theme_changed)
+            self._stamp = self.theme_stamp()
+            self._paths = self.load_paths()
+            self._paths_changed = False
+
+        def theme_stamp(self):
+            """
+            Return the icon theme name and size along with the mtimes of the theme directories.
+            Icons are installed into the size and context subdirectories of a theme, which does not
+            change the theme directory itself, so the mtime of the theme's icon-theme.cache is included too.
+            """
+            stamp = [Gtk.Settings.get_default().get_property("gtk-icon-theme-name"), self.size]
+            for search_dir in self._theme.get_search_path():
                 try:
-                    # Toggle nodisplay if no value is given
-                    if value is None:
-                        xdg_app.nodisplay = not current_value
-
-                    # Check if the nodisplay state even needs changing
-                    elif current_value == value:
-                        logger.info("Application is allready set to %s", "hide" if value else "show")
-                    else:
-                        xdg_app.nodisplay = value
-
-                except Exception as e:
-                    logger.error("Failed to %s application %s", "Hide" if value else "Show", appid)
-                    self.exit_status = 1
-                    logger.error(e)
-
-                # App has been found, No point in continuing
-                break
-        else:
-            logger.error("Unable to find specified application: %s", appid)
+                    stamp.append([search_dir, os.stat(search_dir).st_mtime_ns])
+                    with os.scandir(search_dir) as entries:
+                        theme_dirs = [entry.path for entry in entries if entry.is_dir()]
+                except OSError:
+                    continue
+
+                for theme_dir in theme_dirs:
+                    try:
+                        stamp.append([theme_dir, os.stat(theme_dir).st_mtime_ns])
+                        stamp.append(os.stat(os.path.join(theme_dir, "icon-theme.cache")).st_mtime_ns)
+                    except OSError:
+                        stamp.append(None)
+            return stamp
+
+        def load_paths(self):
+            """Return the saved icon files by icon name, if they where resolved with the current theme."""
+            try:
+                with open(self._paths_file, "r") as stream:
+                    data = json.load(stream)
+            except (OSError, ValueError):
+                return {}
+            return data.get("paths", {}) if data.get("stamp") == self._stamp else {}
+
+        def save_paths(self):
+            if self._paths_changed:
+                self._paths_changed = False
+                paths = {icon: path for icon, path in self._paths.items() if path is not None}
+                with atomic_write(self._paths_file) as stream:
+                    json.dump({"stamp": self._stamp, "paths": paths}, stream)
+
+        def on_theme_changed(self, _):
+            self._stamp = self.theme_stamp()
+            self._paths = {}
+            self._paths_changed = True
+
+        def resolve(self, icon):
+            """Return the file of the given icon, named icons are resolved through the icon theme. None if not found."""
+            if os.path.isabs(icon):
+                return icon
+
+            try:
+                return self._paths[icon]
+            except KeyError:
+                with profiler.span("gui.icon_lookup"):
+                    info = self._theme.lookup_icon(icon, self.size, 0) if icon else None
+                path = info.get_filename() if info else None
+                self._paths[icon] = path
+                if path is not None:
+                    self._paths_changed = True
+                return path
+
+        def load(self, icon, callback, *args):
+            """Load the icon file in the background, callback is called with the pixbuf on the main thread."""
+            pixbuf = self._pixbufs.get(icon)
+            if pixbuf is not None:
+                profiler.count("icon_shared")
+                callback(pixbuf, *args)
+            elif icon in self._waiting:
+                self._waiting[icon].append((callback, args))
+            else:
+                self._waiting[icon] = [(callback, args)]
+                self._executor.submit(self.decode, icon)
+
+        def decode(self, icon):
+            """Decode the icon within a worker thread and hand it over to the main thread."""
+            try:
+                pixbuf = self.scaled_pixbuf(icon)
+            except (GLib.Error, OSError) as e:
+                logger.debug("Failed to load icon: %s", icon)
+                logger.debug(e)
+                pixbuf = None
+            GLib.idle_add(self.on_decoded, icon, pixbuf)
+
+        def on_decoded(self, icon, pixbuf):
+            waiting = self._waiting.pop(icon, ())
+            if pixbuf is not None:
+                self._pixbufs[icon] = pixbuf
+                for callback, args in waiting:
+                    callback(pixbuf, *args)
+            return False
+
+        def scaled_pixbuf(self, icon):
+            """Return the scaled icon from the disk cache, decoding and caching the original on a miss."""
+            mtime = str(os.stat(icon).st_mtime_ns)
+            cache_path = os.path.join(self._cache_dir, hashlib.sha1(icon.encode("utf-8")).hexdigest() + ".png")
+            if os.path.exists(cache_path):
+                with profiler.span("gui.icon_decode"):
+                    pixbuf = GdkPixbuf.Pixbuf.new_from_file(cache_path)
+                if pixbuf.get_option(self._mtime_option) == mtime:
+                    profiler.count("icon_cache_hits")
+                    return pixbuf
+
+            with profiler.span("gui.icon_decode"):
+                pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(icon, width=self.size, height=self.size,
+                                                                 preserve_aspect_ratio=False)
+
+            # Partially written icons are never loaded
+            with atomic_write(cache_path, "wb") as stream:
+                stream.write(pixbuf.save_to_bufferv("png", [self._mtime_option], [mtime])[1])
+            return pixbuf
+
+        def shutdown(self):
+            """Stop loading any icons that have not started yet and save the resolved icon files."""
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            try:
+                self.save_paths()
+            except OSError as e:
+                logger.debug("Failed to save resolved icons: %s", e)
+
+    return AppHideApp
 
 
 if __name__ == "__main__":
+    # Profiling can also be enabled for the gui, which takes no arguments
+    if os.environ.get("APPHIDE_PROFILE"):
+        profiler.enable(os.environ["APPHIDE_PROFILE"])
+
     if sys.argv[1:]:
         logger.setLevel(logging.INFO)
         cli = CLIManager()
         exit_status = cli.exit_status
     else:
         logger.setLevel(logging.DEBUG)
-        app = AppHideApp()
+        app = load_gui()()
         exit_status = app.run(None)
 
     sys.exit(exit_status)
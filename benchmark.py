@@ -0,0 +1,826 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 William Forde
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Development checks and benchmarks for AppHide.
+This script is not installed, it's only used to verify and measure apphide.py.
+"""
+
+# Standard library imports
+from argparse import ArgumentParser
+from collections import Counter
+import tracemalloc
+import subprocess
+import sqlite3
+import gc
+import shutil
+import resource
+import tempfile
+import logging
+import random
+import json
+import time
+import sys
+import os
+
+# XDG Package imports
+import xdg.Exceptions
+import xdg.DesktopEntry
+import xdg.BaseDirectory
+
+# AppHide imports
+import apphide
+
+# Python calls that map to filesystem syscalls, used to count syscalls when strace is not available.
+# DirEntry.is_file and is_dir are left out, as they use the file type from the directory listing.
+FS_CALLS = ("stat", "lstat", "listdir", "scandir", "DirEntry.stat")
+
+# Scan passes of each scan mode, along with the mode that is subtracted to only count the last pass
+SCAN_MODES = {"none": ((), None),
+              "listdir": (("listdir",), "none"),
+              "scandir": (("scandir",), "none"),
+              "scandir-cached": (("scandir", "scandir"), "scandir")}
+
+# Getters that must match between pyxdg and the fast parser
+GETTERS = ("getName", "getComment", "getIcon", "getNoDisplay", "getType", "getOnlyShowIn", "getNotShowIn",
+           "getKeywords", "getExec", "getCategories")
+
+
+# Edge cases that are always compared, along with the files of the corpus
+EDGE_CASES = {
+    "crlf.desktop": "[Desktop Entry]\r\nName=CRLF\r\nName[x1]=Localized\r\nNoDisplay=true\r\nType=Application\r\n",
+    "cr.desktop": "[Desktop Entry]\rName=CR\rKeywords=a;b;\rType=Application\r",
+    "repeated-group.desktop": "[Desktop Entry]\nName=First\nNoDisplay=true\n[Desktop Entry]\nName=Last\n",
+    "kde-group.desktop": "# Comment\n\n[KDE Desktop Entry]\nName=KDE\nType=Application\n",
+    "group-order.desktop": "[Desktop Action new]\nName=Action\n[KDE Desktop Entry]\nName=KDE\n"
+                           "[Desktop Entry]\nName=Main\n[Desktop Action other]\nExec=other\n",
+    "spacing.desktop": "  [Desktop Entry]  \n  Name = Spaced  \nName[x1] = Localized \nKeywords=a\\;b;c;\n"
+                       "Categories=A|B\nNotShowIn=a\\,b,c\n\tExec\t=\tspaced %U\n",
+    "key-before-group.desktop": "Name=Orphan\n[Desktop Entry]\nName=Main\n",
+    "missing-group.desktop": "[Desktop Action new]\nName=Action\n",
+    "invalid-line.desktop": "[Desktop Entry]\nName=Invalid\nNo separator on this line\n",
+}
+
+# Files that pyxdg rejects, but the fast parser reads on purpose. Lines without a "=" are ignored,
+# instead of checking every line of every file for them.
+INTENDED_DIFFERENCES = {"invalid-line.desktop"}
+
+
+def find_corpus(app_dirs):
+    """Return all ".desktop" files within the given applications directories."""
+    corpus = []
+    for app_dir in app_dirs:
+        if os.path.isdir(app_dir):
+            for app_name in sorted(os.listdir(app_dir)):
+                if app_name.endswith(".desktop"):
+                    corpus.append(os.path.join(app_dir, app_name))
+    return corpus
+
+
+def timed(func, corpus, repeat):
+    """Return the best time of calling func on every file of the corpus."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for filepath in corpus:
+            try:
+                func(filepath)
+            except xdg.Exceptions.ParsingError:
+                pass
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def check_parser(corpus, repeat):
+    """
+    Compare the fast parser against pyxdg and time both, the edge cases are compared as well.
+    Files that pyxdg rejects must be rejected by the fast parser too. Returns the number of mismatches.
+    """
+    with tempfile.TemporaryDirectory(prefix="apphide-edge-") as edge_dir:
+        edge_cases = []
+        for name, content in EDGE_CASES.items():
+            edge_cases.append(os.path.join(edge_dir, name))
+            with open(edge_cases[-1], "w", newline="") as stream:
+                stream.write(content)
+
+        mismatches = 0
+        for filepath in corpus + edge_cases:
+            try:
+                full = xdg.DesktopEntry.DesktopEntry(filepath)
+            except xdg.Exceptions.ParsingError:
+                full = None
+            try:
+                fast = apphide.DesktopRecord(filepath, apphide.DesktopRecord.read_fields(filepath))
+            except xdg.Exceptions.ParsingError:
+                fast = None
+
+            if full is None or fast is None:
+                if (full is None) != (fast is None) and os.path.basename(filepath) not in INTENDED_DIFFERENCES:
+                    mismatches += 1
+                    print("MISMATCH %s: %s" % (filepath, "only pyxdg rejects" if fast else "only pyxdg accepts"))
+                continue
+
+            for getter in GETTERS:
+                expected = getattr(full, getter)()
+                result = getattr(fast, getter)()
+                if expected != result:
+                    mismatches += 1
+                    print("MISMATCH %s %s: %r != %r" % (filepath, getter, result, expected))
+
+    pyxdg_time = timed(xdg.DesktopEntry.DesktopEntry, corpus, repeat)
+    fast_time = timed(apphide.DesktopRecord.read_fields, corpus, repeat)
+    print("Parsed %d files and %d edge cases, %d mismatches" % (len(corpus), len(edge_cases), mismatches))
+    print("pyxdg DesktopEntry: %.2f ms" % (pyxdg_time * 1000))
+    print("fast parser:        %.2f ms (%.1fx)" % (fast_time * 1000, pyxdg_time / fast_time if fast_time else 0))
+    return mismatches
+
+
+def check_startup(cli_args, repeat):
+    """
+    Run the command line with "-X importtime" and check that GObject is never imported.
+    Returns the number of forbidden modules that where imported.
+    """
+    command = [sys.executable, "-X", "importtime", apphide.__file__] + cli_args
+    best = None
+    imported = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+        # Lines are formatted as "import time: self [us] | cumulative | imported package"
+        imported = {}
+        for line in proc.stderr.splitlines():
+            if line.startswith("import time:") and "|" in line:
+                _, cumulative, module = line.split("|")
+                if cumulative.strip().isdigit():
+                    imported[module.strip()] = int(cumulative)
+
+    forbidden = [module for module in imported if module == "gi" or module.startswith("gi.")]
+    slowest = sorted(((cumulative, module) for module, cumulative in imported.items() if "." not in module),
+                     reverse=True)[:5]
+
+    print("apphide %s: %.2f ms, %d modules imported" % (" ".join(cli_args), best * 1000, len(imported)))
+    for cumulative, module in slowest:
+        print("  %-20s %.2f ms" % (module, cumulative / 1000))
+    for module in forbidden:
+        print("FORBIDDEN import on the command line path: %s" % module)
+    return len(forbidden)
+
+
+class FakeApp(object):
+    """Minimal stand-in for XDGManager, used to fill the GUI with synthetic applications."""
+
+    def __init__(self, number):
+        self.name = "Application %05d" % number
+        self.description = "Synthetic application number %d, used to benchmark the application list" % number
+        self.icon = apphide.DEFAULT_ICON
+        self.nodisplay = number % 4 == 0
+        self.appid = "application%05d" % number
+        self.sort_key = self.name.lower()
+        self.search_text = apphide.normalize_text(self.name + "\n" + self.description)
+
+
+def check_gui(count):
+    """
+    Start the GUI with the given number of synthetic applications and report
+    the time and memory used until the first frame is drawn. Requires a display.
+    """
+    apphide.get_xdg_apps = lambda **_: [FakeApp(number) for number in range(count)]
+    # The synthetic applications are not installed, the user files in the real home must not be seen as leftovers
+    apphide.collect_garbage = lambda dry_run=False: ([], [])
+    tracemalloc.start()
+    start = time.perf_counter()
+    app = apphide.load_gui()()
+    result = {}
+
+    def on_draw(*_):
+        if not result:
+            result["first_frame"] = time.perf_counter() - start
+            result["python_peak"] = tracemalloc.get_traced_memory()[1]
+            apphide.GLib.idle_add(app.quit)
+
+    def on_activate(*_):
+        app.window.connect("draw", on_draw)
+
+    app.connect_after("activate", on_activate)
+    app.run(None)
+    app.window.icon_loader.shutdown()
+
+    print("GUI with %d applications" % count)
+    print("  time to first frame: %.2f ms" % (result["first_frame"] * 1000))
+    print("  python memory peak:  %.2f MiB" % (result["python_peak"] / 1048576))
+    print("  max resident memory: %.2f MiB" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+    return 0
+
+
+def generate_tree(root, apps, duplicates, flatpaks, locales, hidden, leftovers, seed=0):
+    """
+    Generate a synthetic XDG layout with the given number of applications.
+    Returns the environment variables that point apphide at the generated layout.
+
+    :param duplicates: Share of applications that also have a user copy.
+    :param flatpaks: Share of applications that are exported by flatpak instead of installed in the system.
+    :param locales: Number of localized Name/Comment/Keywords keys per application.
+    :param hidden: Share of applications that have NoDisplay set.
+    :param leftovers: Number of tracked user files, whose application has been uninstalled.
+    """
+    rng = random.Random(seed)
+    data_home = os.path.join(root, "home", ".local", "share")
+    system_dir = os.path.join(root, "usr", "share")
+    flatpak_dir = os.path.join(root, "var", "lib", "flatpak", "exports", "share")
+    for data_dir in (data_home, system_dir, flatpak_dir):
+        os.makedirs(os.path.join(data_dir, "applications"))
+
+    def write_entry(data_dir, appid, number, nodisplay):
+        lines = ["[Desktop Entry]", "Type=Application", "Name=Benchmark App %05d" % number,
+                 "Comment=Synthetic application %d used for benchmarking" % number, "Icon=bench-%d" % number,
+                 "Exec=bench-app-%d %%U" % number, "Categories=Development;Utility;", "Keywords=bench;synthetic;",
+                 "NoDisplay=%s" % ("true" if nodisplay else "false")]
+        for locale in range(locales):
+            lines.append("Name[x%d]=Localized App %05d" % (locale, number))
+            lines.append("Comment[x%d]=Localized comment %d" % (locale, number))
+            lines.append("Keywords[x%d]=localized;keywords;" % locale)
+        lines += ["", "[Desktop Action new-window]", "Name=New Window", "Exec=bench-app-%d --new" % number]
+
+        filepath = os.path.join(data_dir, "applications", appid + ".desktop")
+        with open(filepath, "w") as stream:
+            stream.write("\n".join(lines) + "\n")
+        return filepath
+
+    for number in range(apps):
+        appid = "org.bench.App%05d" % number
+        nodisplay = rng.random() < hidden
+        write_entry(flatpak_dir if rng.random() < flatpaks else system_dir, appid, number, nodisplay)
+        if rng.random() < duplicates:
+            write_entry(data_home, appid, number, not nodisplay)
+
+    # Leftovers only exist in the user directory, they get tracked before measuring
+    leftover_files = [write_entry(data_home, "org.bench.Leftover%05d" % number, number, True)
+                      for number in range(leftovers)]
+    with open(os.path.join(root, "leftovers.json"), "w") as stream:
+        json.dump(leftover_files, stream)
+
+    # Installed applications are older than the racy window of the scan index, so their listings can be reused
+    installed = time.time() - 3600
+    for data_dir in (data_home, system_dir, flatpak_dir):
+        os.utime(os.path.join(data_dir, "applications"), (installed, installed))
+
+    env = dict(os.environ)
+    env.update({"HOME": os.path.join(root, "home"),
+                "XDG_DATA_HOME": data_home,
+                "XDG_DATA_DIRS": os.pathsep.join([system_dir, flatpak_dir]),
+                "XDG_CONFIG_HOME": os.path.join(root, "home", ".config"),
+                "XDG_CACHE_HOME": os.path.join(root, "home", ".cache"),
+                "XDG_RUNTIME_DIR": os.path.join(root, "run")})
+    os.makedirs(env["XDG_RUNTIME_DIR"], mode=0o700)
+    return env
+
+
+def best_time(func, repeat):
+    """Return the best time of calling func repeat times."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure(root, repeat):
+    """
+    Time the hot paths of apphide against the generated layout, this runs within a child
+    process that was started with the environment of the layout. Returns the results in seconds.
+    """
+    # Output is formatted the same as normal, but never printed
+    devnull = open(os.devnull, "w")
+    apphide.consoleHandler.setStream(devnull)
+    apphide.logger.setLevel(logging.INFO)
+
+    # Track the leftover files, so that the garbage collection has to clean them up
+    with open(os.path.join(root, "leftovers.json")) as stream:
+        leftovers = json.load(stream)
+    tracker = apphide.Tracker()
+    with tracker.batch():
+        for filepath in leftovers:
+            tracker.add(filepath)
+    apphide.XDGManager._tracker = None
+
+    results = {"get_xdg_apps_cold": best_time(lambda: apphide.get_xdg_apps(rebuild_index=True), 1),
+               "get_xdg_apps_warm": best_time(apphide.get_xdg_apps, repeat),
+               "collect_garbage_dry_run": best_time(lambda: apphide.collect_garbage(dry_run=True), repeat),
+               "collect_garbage": best_time(apphide.collect_garbage, 1)}
+
+    xdg_apps = apphide.get_xdg_apps()
+    results["list_apps"] = best_time(lambda: apphide.CLIManager(["-l", "--no-daemon"]), repeat)
+    results["list_apps_ndjson"] = best_time(
+        lambda: apphide.CLIManager(["-l", "-f", "ndjson", "--no-daemon"], stream=devnull), repeat)
+    results["change_state_toggle"] = best_time(
+        lambda: apphide.CLIManager(["-t", xdg_apps[0].appid, "--no-daemon"]), repeat)
+
+    # Tracker storage, with one tracked file per app
+    tracker = apphide.Tracker()
+    sample = [xdg_app.filepath for xdg_app in xdg_apps]
+    with tracker.batch():
+        for filepath in sample:
+            tracker.add(filepath)
+
+    def tracker_save():
+        tracker.add(sample[0])
+        tracker.save()
+
+    results["tracker_load"] = best_time(apphide.Tracker, repeat)
+    results["tracker_save"] = best_time(tracker_save, repeat)
+    results["hash_file"] = best_time(lambda: [apphide.Tracker.hash_file(filepath) for filepath in sample], repeat)
+    devnull.close()
+    return results
+
+
+def retained_memory(func):
+    """Return the result of func along with the memory, in bytes, that is still allocated by it."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = func()
+        gc.collect()
+        return result, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def measure_memory():
+    """
+    Measure the memory kept by the loaded applications, against keeping a parsed pyxdg DesktopEntry
+    per application, this runs within a child process that was started with the environment of the layout.
+    """
+    # Build the scan index first, so that the parse results are not part of the measurement
+    apphide.get_xdg_apps()
+
+    xdg_apps, apps_size = retained_memory(apphide.get_xdg_apps)
+    entries, pyxdg_size = retained_memory(lambda: [xdg.DesktopEntry.DesktopEntry(xdg_app.filepath)
+                                                   for xdg_app in xdg_apps])
+    return {"apps": len(xdg_apps), "compact_bytes": apps_size, "pyxdg_bytes": pyxdg_size}
+
+
+def check_memory(args):
+    """Report the memory kept per application, for a synthetic layout."""
+    with tempfile.TemporaryDirectory(prefix="apphide-bench-") as root:
+        env = generate_tree(root, args.apps, 0, 0, args.locales, 0, 0)
+        command = [sys.executable, os.path.abspath(__file__), "memory-measure", root]
+        proc = subprocess.run(command, env=env, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        results = json.loads(proc.stdout)
+
+    apps = results["apps"]
+    print("%-24s %12s %10s" % ("kept per application", "total KiB", "bytes"))
+    print("%-24s %12.1f %10d" % ("apphide records", results["compact_bytes"] / 1024, results["compact_bytes"] / apps))
+    print("%-24s %12.1f %10d" % ("pyxdg DesktopEntry", results["pyxdg_bytes"] / 1024, results["pyxdg_bytes"] / apps))
+    return 0
+
+
+def check_suite(args):
+    """
+    Generate a synthetic layout, measure apphide against it in a headless child process
+    and compare the results with a saved baseline. Returns the number of regressions.
+    """
+    config = {"apps": args.apps, "duplicates": args.duplicates, "flatpaks": args.flatpaks,
+              "locales": args.locales, "hidden": args.hidden, "leftovers": args.leftovers}
+
+    with tempfile.TemporaryDirectory(prefix="apphide-bench-") as root:
+        env = generate_tree(root, **config)
+
+        # The xdg directories are read when xdg.BaseDirectory is imported, so a new process is needed
+        command = [sys.executable, os.path.abspath(__file__), "--repeat", str(args.repeat), "measure", root]
+        proc = subprocess.run(command, env=env, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        report = {"config": config, "results": json.loads(proc.stdout)}
+
+    if args.output:
+        with open(args.output, "w") as stream:
+            json.dump(report, stream, indent=4)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as stream:
+            baseline = json.load(stream)["results"]
+
+    regressions = 0
+    print("%-22s %12s %12s %8s" % ("benchmark", "time ms", "baseline ms", "ratio"))
+    for name, elapsed in report["results"].items():
+        if name in baseline:
+            ratio = elapsed / baseline[name] if baseline[name] else 0
+            regressed = ratio > args.threshold
+            regressions += regressed
+            print("%-22s %12.2f %12.2f %7.2fx%s" % (name, elapsed * 1000, baseline[name] * 1000, ratio,
+                                                    " REGRESSION" if regressed else ""))
+        else:
+            print("%-22s %12.2f %12s %8s" % (name, elapsed * 1000, "-", "-"))
+    return regressions
+
+
+def home_environment(env, home):
+    """Return the environment of a generated layout, with the user directories moved into the given home."""
+    return dict(env, HOME=home, XDG_DATA_HOME=os.path.join(home, ".local", "share"),
+                XDG_CONFIG_HOME=os.path.join(home, ".config"), XDG_CACHE_HOME=os.path.join(home, ".cache"))
+
+
+def check_fleet(args):
+    """
+    Apply a profile to many fake home directories with --homes, against applying it to each home
+    with its own process, then verify that every home ended up with the hidden applications of the profile.
+    Returns the number of homes that don't match the profile.
+    """
+    rng = random.Random(0)
+    command = [sys.executable, apphide.__file__, "--no-daemon"]
+    with tempfile.TemporaryDirectory(prefix="apphide-bench-") as root:
+        env = generate_tree(root, args.apps, 0, args.flatpaks, 0, 0, 0)
+        appids = []
+        for data_dir in env["XDG_DATA_DIRS"].split(os.pathsep):
+            app_dir = os.path.join(data_dir, "applications")
+            appids.extend(name[:-8].lower() for name in os.listdir(app_dir))
+
+        profile = os.path.join(root, "profile.json")
+        hidden = sorted(rng.sample(appids, int(len(appids) * args.hidden)))
+        with open(profile, "w") as stream:
+            json.dump({"hidden": hidden}, stream)
+
+        # Some users already have their own copy of an application, which has to be changed in place
+        homes = {}
+        for mode in ("fleet", "sequential"):
+            homes[mode] = [os.path.join(root, mode, "user%03d" % number) for number in range(args.homes)]
+            for home in homes[mode]:
+                os.makedirs(os.path.join(home, ".local", "share", "applications"))
+                if rng.random() < 0.5:
+                    src = os.path.join(root, "usr", "share", "applications")
+                    shutil.copy(os.path.join(src, rng.choice(os.listdir(src))),
+                                os.path.join(home, ".local", "share", "applications"))
+
+        start = time.perf_counter()
+        proc = subprocess.run(command + ["--homes"] + homes["fleet"] + ["--apply-profile", profile], env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        fleet_time = time.perf_counter() - start
+        if proc.returncode:
+            print(proc.stdout)
+
+        start = time.perf_counter()
+        for home in homes["sequential"]:
+            subprocess.run(command + ["--apply-profile", profile], env=home_environment(env, home),
+                           stdout=subprocess.DEVNULL, check=True)
+        sequential_time = time.perf_counter() - start
+
+        mismatches = 0
+        for home in homes["fleet"] + homes["sequential"]:
+            proc = subprocess.run(command + ["-l", "-y", "-f", "json"], env=home_environment(env, home),
+                                  stdout=subprocess.PIPE, universal_newlines=True, check=True)
+            found = sorted(record["appid"] for record in json.loads(proc.stdout))
+            if found != hidden:
+                print("Home does not match the profile: %s" % home)
+                mismatches += 1
+
+    print("%-12s %10s %12s" % ("mode", "time ms", "ms per home"))
+    print("%-12s %10.1f %12.1f" % ("fleet", fleet_time * 1000, fleet_time * 1000 / args.homes))
+    print("%-12s %10.1f %12.1f" % ("sequential", sequential_time * 1000, sequential_time * 1000 / args.homes))
+    print("%d of %d homes match the profile" % (args.homes * 2 - mismatches, args.homes * 2))
+    return mismatches
+
+
+def stress_worker(root, rounds, seed):
+    """
+    Change the state of the applications of the generated layout at random, this runs within a child process
+    that was started with the environment of the layout, alongside many other workers. Returns the number of
+    commands that failed. Applications are loaded again for every command, so the workers see each other's changes
+    late, the same as separate command line calls would.
+    """
+    rng = random.Random(seed)
+    apphide.consoleHandler.setStream(open(os.devnull, "w"))
+    apphide.logger.setLevel(logging.INFO)
+    errors = logging.StreamHandler(sys.stderr)
+    errors.setLevel(logging.ERROR)
+    apphide.logger.addHandler(errors)
+
+    with open(os.path.join(root, "stress.json")) as stream:
+        appids = json.load(stream)["appids"]
+
+    failures = 0
+    for _ in range(rounds):
+        action = rng.choice(("-i", "-s", "-t", "--apply-profile"))
+        if action == "--apply-profile":
+            profile = os.path.join(root, "profile-%d.json" % seed)
+            with open(profile, "w") as stream:
+                json.dump({"hidden": rng.sample(appids, rng.randint(0, len(appids)))}, stream)
+            argv = [action, profile] + ["--id=" + appid for appid in appids]
+        else:
+            argv = [action, rng.choice(appids)]
+
+        cli = apphide.CLIManager(argv + ["--no-daemon"])
+        failures += cli.exit_status != 0
+    return failures
+
+
+def check_stress(args):
+    """
+    Run many processes that change the same few applications at once, then check that no change was lost.
+    Every user file must be tracked with its current hash and must only differ from its system file by NoDisplay.
+    Finally all applications are reverted to their system state, which must leave no user file behind.
+    Returns the number of problems found.
+    """
+    problems = 0
+    with tempfile.TemporaryDirectory(prefix="apphide-bench-") as root:
+        env = generate_tree(root, args.apps, 0, args.flatpaks, 0, args.hidden, 0)
+        system_files = {}
+        for data_dir in env["XDG_DATA_DIRS"].split(os.pathsep):
+            app_dir = os.path.join(data_dir, "applications")
+            for name in sorted(os.listdir(app_dir)):
+                system_files[name] = os.path.join(app_dir, name)
+
+        # Applications that are hidden by their system file are not listed, so they can't be shown by appid
+        appids = sorted(name[:-8].lower() for name, filepath in system_files.items()
+                        if not apphide.DesktopRecord.parse(filepath)["NoDisplay"])[:args.contended]
+        with open(os.path.join(root, "stress.json"), "w") as stream:
+            json.dump({"appids": appids}, stream)
+
+        start = time.perf_counter()
+        procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "stress-worker", root,
+                                   "--rounds", str(args.rounds), "--seed", str(seed)],
+                                  env=env, stdout=subprocess.PIPE, universal_newlines=True)
+                 for seed in range(args.processes)]
+        failures = 0
+        for proc in procs:
+            output = proc.communicate()[0]
+            if proc.returncode:
+                print("Stress worker exited with status %d" % proc.returncode)
+                problems += 1
+            else:
+                failures += json.loads(output)
+        elapsed = time.perf_counter() - start
+        if failures:
+            print("%d commands failed" % failures)
+            problems += failures
+
+        user_dir = os.path.join(env["XDG_DATA_HOME"], "applications")
+        tracker_db = os.path.join(env["XDG_CONFIG_HOME"], "apphide", "tracker.db")
+
+        def check_tracker():
+            found = 0
+            with sqlite3.connect(tracker_db) as db:
+                tracked = dict(db.execute("SELECT path, hash FROM tracked"))
+            for name in os.listdir(user_dir):
+                filepath = os.path.join(user_dir, name)
+                if filepath not in tracked:
+                    print("User file is not tracked: %s" % filepath)
+                    found += 1
+                elif tracked.pop(filepath) != apphide.Tracker.hash_file(filepath):
+                    print("Tracked hash does not match user file: %s" % filepath)
+                    found += 1
+                else:
+                    fields = apphide.DesktopRecord.parse(filepath)
+                    expected = dict(apphide.DesktopRecord.parse(system_files[name]), NoDisplay=fields["NoDisplay"])
+                    if fields != expected:
+                        print("User file differs from its system file: %s" % filepath)
+                        found += 1
+            for filepath in tracked:
+                print("Tracked file does not exist: %s" % filepath)
+                found += 1
+            return found
+
+        problems += check_tracker()
+
+        # Revert every application to the state of its system file, which removes all user files
+        hidden = [name[:-8].lower() for name, filepath in system_files.items()
+                  if apphide.DesktopRecord.parse(filepath)["NoDisplay"]]
+        profile = os.path.join(root, "system.json")
+        with open(profile, "w") as stream:
+            json.dump({"hidden": hidden}, stream)
+        subprocess.run([sys.executable, apphide.__file__, "--no-daemon", "--apply-profile", profile], env=env,
+                       stdout=subprocess.DEVNULL, check=True)
+        problems += check_tracker()
+        for name in os.listdir(user_dir):
+            print("User file was left behind: %s" % name)
+            problems += 1
+
+    commands = args.processes * args.rounds
+    print("%d processes ran %d commands in %.1f ms, %d problems found" % (args.processes, commands,
+                                                                         elapsed * 1000, problems))
+    return problems
+
+
+def scan_pass(kind, index):
+    """Find all desktop files once, using the flat listdir scan of older versions or the scandir scan index."""
+    found = []
+    for data_dir in xdg.BaseDirectory.xdg_data_dirs:
+        app_dir = os.path.join(data_dir, "applications")
+        if kind == "scandir":
+            found.extend(index.listdir(app_dir))
+        elif os.path.exists(app_dir):
+            found.extend((name, os.path.join(app_dir, name)) for name in os.listdir(app_dir)
+                         if name.endswith(".desktop"))
+    return found
+
+
+def scan_count(mode, proxy):
+    """
+    Run the scan passes of the given mode, this runs within a child process that was started
+    with the environment of the layout. Returns the counted filesystem calls if proxy is set.
+    """
+    index = apphide.ScanIndex(rebuild=True)
+    counts = Counter()
+
+    def profile(_, event, arg):
+        if event == "c_call" and getattr(arg, "__qualname__", None) in FS_CALLS:
+            counts[arg.__qualname__] += 1
+
+    if proxy:
+        sys.setprofile(profile)
+    try:
+        for kind in SCAN_MODES[mode][0]:
+            scan_pass(kind, index)
+    finally:
+        sys.setprofile(None)
+    return dict(counts)
+
+
+def strace_counts(command, env):
+    """Run the command under strace and return the number of calls of each syscall."""
+    with tempfile.NamedTemporaryFile("r", suffix=".strace") as output:
+        subprocess.run(["strace", "-f", "-c", "-o", output.name] + command, env=env,
+                       stdout=subprocess.DEVNULL, check=True)
+        counts = {}
+        for line in output:
+            fields = line.split()
+            # Rows are: % time, seconds, usecs/call, calls, [errors,] syscall
+            if len(fields) >= 5 and fields[3].isdigit() and fields[-1] != "total":
+                counts[fields[-1]] = int(fields[3])
+        return counts
+
+
+def check_scan(args):
+    """
+    Count the syscalls of one scan of a synthetic layout, for the flat listdir scan of older versions,
+    the scandir scan and a scandir scan with a warm scan index. The syscalls of the process startup
+    are removed by subtracting the count of a run without the measured scan pass.
+    """
+    use_strace = shutil.which("strace") is not None
+    if not use_strace:
+        print("strace not found, counting python filesystem calls instead of syscalls\n")
+
+    with tempfile.TemporaryDirectory(prefix="apphide-bench-") as root:
+        env = generate_tree(root, args.apps, args.duplicates, args.flatpaks, 0, 0, 0)
+        results = {}
+        for mode in SCAN_MODES:
+            command = [sys.executable, os.path.abspath(__file__), "scan-count", mode, root]
+            if use_strace:
+                results[mode] = strace_counts(command, env)
+            else:
+                proc = subprocess.run(command + ["--proxy"], env=env, stdout=subprocess.PIPE,
+                                      universal_newlines=True, check=True)
+                results[mode] = json.loads(proc.stdout)
+
+    deltas = {}
+    for mode, (_, baseline) in SCAN_MODES.items():
+        if baseline:
+            names = set(results[mode]) | set(results[baseline])
+            deltas[mode] = {name: results[mode].get(name, 0) - results[baseline].get(name, 0) for name in names}
+
+    names = sorted({name for counts in deltas.values() for name, calls in counts.items() if calls})
+    print("%-16s %8s " % ("scan", "total") + " ".join("%10s" % name[-10:] for name in names))
+    for mode, counts in deltas.items():
+        print("%-16s %8d " % (mode, sum(counts.values())) + " ".join("%10d" % counts.get(name, 0) for name in names))
+    return 0
+
+
+def main():
+    default_dirs = [os.path.join(data_dir, "applications") for data_dir in xdg.BaseDirectory.xdg_data_dirs]
+    parser = ArgumentParser(description="Development checks and benchmarks for AppHide.")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of timing runs, the best run is reported")
+    subparsers = parser.add_subparsers(dest="check")
+    subparsers.required = True
+
+    parser_check = subparsers.add_parser("parser", help="Compare the fast parser against pyxdg")
+    parser_check.add_argument("dirs", nargs="*", default=default_dirs,
+                              help="Applications directories to use as the corpus")
+
+    startup_check = subparsers.add_parser("startup", help="Time the command line startup and check its imports")
+    startup_check.add_argument("cli_args", nargs="*", default=["-l"],
+                               help="Command line arguments to run apphide with")
+
+    gui_check = subparsers.add_parser("gui", help="Time the GUI until the first frame, requires a display")
+    gui_check.add_argument("--apps", type=int, default=5000,
+                           help="Number of synthetic applications to list")
+
+    suite_check = subparsers.add_parser("suite", help="Measure apphide against a synthetic XDG layout, headless")
+    suite_check.add_argument("--apps", type=int, default=1500, help="Number of applications")
+    suite_check.add_argument("--duplicates", type=float, default=0.1,
+                             help="Share of applications that also have a user copy")
+    suite_check.add_argument("--flatpaks", type=float, default=0.2,
+                             help="Share of applications that are exported by flatpak")
+    suite_check.add_argument("--locales", type=int, default=20,
+                             help="Number of localized keys per application")
+    suite_check.add_argument("--hidden", type=float, default=0.1, help="Share of hidden applications")
+    suite_check.add_argument("--leftovers", type=int, default=20,
+                             help="Number of tracked user files of uninstalled applications")
+    suite_check.add_argument("--output", help="Save the results as json to this file")
+    suite_check.add_argument("--baseline", help="Compare the results with the json saved by --output")
+    suite_check.add_argument("--threshold", type=float, default=1.2,
+                             help="Ratio against the baseline that counts as a regression")
+
+    scan_check = subparsers.add_parser("scan", help="Count the syscalls of scanning a synthetic XDG layout")
+    scan_check.add_argument("--apps", type=int, default=5000, help="Number of applications")
+    scan_check.add_argument("--duplicates", type=float, default=0.1,
+                            help="Share of applications that also have a user copy")
+    scan_check.add_argument("--flatpaks", type=float, default=0.2,
+                            help="Share of applications that are exported by flatpak")
+
+    scan_count_check = subparsers.add_parser("scan-count", help="Used internally by scan")
+    scan_count_check.add_argument("mode", choices=SCAN_MODES)
+    scan_count_check.add_argument("root", help="Root of the generated layout")
+    scan_count_check.add_argument("--proxy", action="store_true", help="Count python filesystem calls")
+
+    fleet_check = subparsers.add_parser("fleet", help="Apply a profile to many fake home directories, headless")
+    fleet_check.add_argument("--homes", type=int, default=20, help="Number of home directories")
+    fleet_check.add_argument("--apps", type=int, default=1500, help="Number of applications")
+    fleet_check.add_argument("--flatpaks", type=float, default=0.2,
+                             help="Share of applications that are exported by flatpak")
+    fleet_check.add_argument("--hidden", type=float, default=0.1, help="Share of applications the profile hides")
+
+    stress_check = subparsers.add_parser("stress", help="Change the same applications from many processes at once")
+    stress_check.add_argument("--processes", type=int, default=16, help="Number of processes")
+    stress_check.add_argument("--rounds", type=int, default=25, help="Number of commands run by each process")
+    stress_check.add_argument("--apps", type=int, default=200, help="Number of applications")
+    stress_check.add_argument("--contended", type=int, default=8,
+                              help="Number of applications that all processes change")
+    stress_check.add_argument("--flatpaks", type=float, default=0.2,
+                              help="Share of applications that are exported by flatpak")
+    stress_check.add_argument("--hidden", type=float, default=0.3, help="Share of hidden applications")
+
+    stress_worker_check = subparsers.add_parser("stress-worker", help="Used internally by stress")
+    stress_worker_check.add_argument("root", help="Root of the generated layout")
+    stress_worker_check.add_argument("--rounds", type=int, default=25)
+    stress_worker_check.add_argument("--seed", type=int, default=0)
+
+    memory_check = subparsers.add_parser("memory", help="Measure the memory kept per application with tracemalloc")
+    memory_check.add_argument("--apps", type=int, default=5000, help="Number of applications")
+    memory_check.add_argument("--locales", type=int, default=20, help="Number of localized keys per application")
+
+    memory_measure_check = subparsers.add_parser("memory-measure", help="Used internally by memory")
+    memory_measure_check.add_argument("root", help="Root of the generated layout")
+
+    measure_check = subparsers.add_parser("measure", help="Used internally by suite")
+    measure_check.add_argument("root", help="Root of the generated layout")
+    args = parser.parse_args()
+
+    if args.check == "measure":
+        json.dump(measure(args.root, args.repeat), sys.stdout)
+        return 0
+    elif args.check == "scan-count":
+        json.dump(scan_count(args.mode, args.proxy), sys.stdout)
+        return 0
+    elif args.check == "scan":
+        return check_scan(args)
+    elif args.check == "memory-measure":
+        json.dump(measure_memory(), sys.stdout)
+        return 0
+    elif args.check == "memory":
+        return check_memory(args)
+    elif args.check == "fleet":
+        return 1 if check_fleet(args) else 0
+    elif args.check == "stress-worker":
+        json.dump(stress_worker(args.root, args.rounds, args.seed), sys.stdout)
+        return 0
+    elif args.check == "stress":
+        return 1 if check_stress(args) else 0
+    elif args.check == "suite":
+        return 1 if check_suite(args) else 0
+    elif args.check == "gui":
+        return check_gui(args.apps)
+    elif args.check == "startup":
+        return 1 if check_startup(args.cli_args, args.repeat) else 0
+
+    corpus = find_corpus(args.dirs)
+    if not corpus:
+        print("No .desktop files found")
+        return 1
+
+    return 1 if check_parser(corpus, args.repeat) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())